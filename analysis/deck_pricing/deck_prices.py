@@ -9,13 +9,45 @@ from typing import Tuple, List
 """Module for creating plots displaying trends in deck prices over time"""
 
 
+def get_snapshot_deck_prices(mtg_format: str, archetype: str) -> pd.DataFrame:
+    """Computes what query.sql does from the current snapshot. Each card of a deck is priced at the mean over its
+    priced printings on the day of the event, times its quantity, and each day's price is the mean over its decks. Done
+    in floating point rather than numeric, so may differ from the database in the last few digits.
+    :param mtg_format: MTG format to search under
+    :param archetype: archetype of the decks to price
+    :return: DataFrame of date and mean deck price, ordered by date
+    """
+    events = au.load_table('events', 'event_info')
+    events = events.loc[events['format'] == mtg_format, ['tourny_id', 'date']]
+    entries = au.load_table('events', 'event_entry')
+    entries = entries.loc[entries['archetype'] == archetype, ['tourny_id', 'entry_id']]
+    cards = au.load_table('events', 'entry_card')
+    decks = entries.merge(events, on='tourny_id').merge(cards[['entry_id', 'card', 'quantity']], on='entry_id')
+    decks['card'] = decks['card'].astype(str)
+
+    prices = au.load_table('prices', 'pricing')
+    prices = au.decode_categoricals(prices[prices['card'].isin(decks['card'].unique())])
+    printings = au.load_table('cards', 'printings')
+    printings = au.decode_categoricals(printings[printings['card'].isin(decks['card'].unique())])
+    prices = prices.merge(printings[['card', 'set']], on=['card', 'set'])
+
+    card_prices = decks.merge(prices[['card', 'date', 'price']], on=['card', 'date'])
+    card_prices['price'] = card_prices['price'] * card_prices['quantity']
+    card_prices = card_prices.groupby(['date', 'entry_id', 'card'], observed=True)['price'].mean()
+    deck_prices = card_prices.groupby(level=['date', 'entry_id']).sum()
+    return deck_prices.groupby(level='date').mean().reset_index().sort_values('date')
+
+
 def get_deck_prices(mtg_format: str, archetype: str) -> pd.DataFrame:
     # get raw data
-    query = au.load_query('query.sql').format(format=mtg_format, archetype=archetype)
-    results = au.generic_search(query)
+    if au.using_snapshot():
+        data_frame = get_snapshot_deck_prices(mtg_format, archetype)
+    else:
+        data_frame = au.search_frame(au.load_query('query.sql'), {'format': mtg_format, 'archetype': archetype},
+                                     ['date', 'price'])
 
     # data frame with correct column types
-    data_frame = pd.DataFrame(results, columns=['date', 'price'])
+    data_frame = data_frame.reindex(columns=['date', 'price'])
     data_frame['price'] = pd.to_numeric(data_frame['price'])
     data_frame['date'] = pd.to_datetime(data_frame['date'])
 
@@ -0,0 +1,65 @@
+import argparse as ap
+import pathlib as pl
+import time
+from typing import Optional
+
+import pandas as pd
+
+import analysis.metagame_comp.common as c
+import analysis.utility as au
+
+"""Benchmark for metagame_comp_over_time, checking the single query prefix sum version returns the same DataFrame as
+running the original per day metagame query once for every day, then timing both. The original query scans
+events.event_entry and events.event_info rather than the daily archetype counts rollup, so the check also covers the
+rollup being up to date. Run as 'python -m analysis.metagame_comp.benchmark -s start_date -e end_date -f format'"""
+
+# Constants
+LEGACY_QUERY_NAME = 'legacy_metagame_comp'
+LEGACY_QUERY_PATH = pl.Path(__file__).parent / 'legacy_query.sql'
+
+
+def legacy_metagame_comp_over_time(start_date: str, end_date: str, length: int, mtg_format: str,
+                                   workers: Optional[int] = None) -> pd.DataFrame:
+    """Per day version of metagame_comp_over_time it replaced, kept as a baseline. Runs the original per day metagame
+    query for every day, rescanning the past 'length' days of entries each time.
+    """
+    def get_metagame_comp(date: str) -> list:
+        params = {'date': date, 'length': length, 'format': mtg_format}
+        return au.generic_search(au.load_query(LEGACY_QUERY_PATH), params, prepare_name=LEGACY_QUERY_NAME)
+
+    dates = list(au.date_range(start_date, end_date, length))
+    comps = au.run_concurrently(get_metagame_comp, dates, workers)
+    rows = [(date, *metagame) for date, metagames in zip(dates, comps) for metagame in metagames]
+    data_frame = pd.DataFrame(columns=['date', 'archetype', 'percentage'], data=rows)
+    data_frame['date'] = pd.to_datetime(data_frame['date'])  # set as date type
+    data_frame = data_frame.set_index(pd.DatetimeIndex(data_frame['date']))
+    return data_frame
+
+
+def main() -> None:
+    parser = ap.ArgumentParser()
+    parser.add_argument('-s', required=True, help='start date')
+    parser.add_argument('-e', required=True, help='end date')
+    parser.add_argument('-f', required=True, help='MTG format')
+    parser.add_argument('-l', default=c.DEFAULT_DAY_LENGTH, type=int, help='number of days in each rolling period')
+    parser.add_argument('-w', default=1, type=int, help='threads running the legacy per day queries')
+    parser.add_argument('-r', default=3, type=int, help='times to run each version when timing')
+    args = parser.parse_args()
+
+    versions = (('current', lambda: c.metagame_comp_over_time(args.s, args.e, args.l, args.f)),
+                ('legacy', lambda: legacy_metagame_comp_over_time(args.s, args.e, args.l, args.f, args.w)))
+    current, legacy = (run() for _, run in versions)
+    if not current.equals(legacy):
+        print('results differ from the legacy per day queries, is the rollup refreshed?')
+        return
+
+    print(f'{len(current)} rows over {current["date"].nunique()} days')
+    for name, run in versions:
+        start = time.perf_counter()
+        for _ in range(args.r):
+            run()
+        print(f'{name}: {(time.perf_counter() - start) / args.r:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import analysis.utility as au
 import datetime as dt
@@ -6,6 +7,9 @@ import argparse as ap
 from typing import List, Tuple
 
 DEFAULT_DAY_LENGTH = 14
+METAGAME_QUERY_NAME = 'metagame_comp'
+METAGAME_QUERY_PATH = pl.Path(__file__).parent / 'query.sql'
+DAILY_COUNTS_QUERY_PATH = pl.Path(__file__).parent / 'daily_counts.sql'
 
 
 def create_pic_dirc(mtg_format: str, start_date: str, end_date: str) -> pl.Path:
@@ -29,8 +33,30 @@ def get_metagame_comp(date: str, length: int, mtg_format: str) -> List[Tuple[str
     :param mtg_format: MTG format to search under
     :return: list of archetype name and its metagame percentage
     """
-    query = au.load_query('query.sql').format(date=date, length=length, format=mtg_format)
-    return au.generic_search(query)
+    if au.using_snapshot():  # the rolling composition of a single day
+        start_date = (dt.datetime.strptime(date, '%Y-%m-%d') - dt.timedelta(days=length)).strftime('%Y-%m-%d')
+        data_frame = metagame_comp_over_time(start_date, date, length, mtg_format)
+        return list(zip(data_frame['archetype'].tolist(), data_frame['percentage'].tolist()))
+
+    params = {'date': date, 'length': length, 'format': mtg_format}
+    return au.generic_search(au.load_query(METAGAME_QUERY_PATH), params, prepare_name=METAGAME_QUERY_NAME)
+
+
+def get_daily_archetype_counts(start_date: str, end_date: str, mtg_format: str) -> List[Tuple[dt.date, str, int]]:
+    """Retrieves the number of entries of each archetype on each day from the given start date to end date (inclusive),
+    for the given format. Days and archetypes without any entries are left out
+    :param start_date: first day to count
+    :param end_date: last day to count
+    :param mtg_format: MTG format to search under
+    :return: list of date, archetype name, and number of entries
+    """
+    if au.using_snapshot():
+        counts = au.load_table('events', 'daily_archetype_counts')
+        counts = counts[(counts['format'] == mtg_format) & counts['date'].between(start_date, end_date)]
+        return list(zip(counts['date'].dt.date, counts['archetype'].astype(str), counts['amount'].tolist()))
+
+    params = {'start': start_date, 'end': end_date, 'format': mtg_format}
+    return au.generic_search(au.load_query(DAILY_COUNTS_QUERY_PATH), params)
 
 
 def metagame_comp_over_time(start_date: str, end_date: str, length: int, mtg_format: str) -> pd.DataFrame:
@@ -38,15 +64,39 @@ def metagame_comp_over_time(start_date: str, end_date: str, length: int, mtg_for
     of 'length' days, for the given format. For each day between the start and end, returns the metagame makeup for that
     day and the past 'length' days. Each row in returned dataframe contains date, archetype, and percentage that
     archetype made up in metagame on that day
+
+    Daily archetype counts are retrieved in one query, then summed over each rolling period as the difference of two
+    prefix sums, so each day costs the same no matter its period's length. Matches running get_metagame_comp on each
+    day, archetypes of a day ordered by percentage and then name
     :param start_date: dates to start from
     :param end_date: date to end at
     :param length: how many previous days to consider in metgame makeup for a given day
     :param mtg_format: format to search under
     :return: Dataframe with metagame compositions over time
     """
-    dates_to_metagames = {date: get_metagame_comp(date, length, mtg_format)
-                          for date in au.date_range(start_date, end_date, length)}
-    rows = [(date, *metagame) for date, metagames in dates_to_metagames.items() for metagame in metagames]
+    start = dt.datetime.strptime(start_date, '%Y-%m-%d').date()
+    days = (dt.datetime.strptime(end_date, '%Y-%m-%d').date() - start).days + 1
+    daily_counts = get_daily_archetype_counts(start_date, end_date, mtg_format)
+    archetypes = sorted({archetype for _, archetype, _ in daily_counts})
+    archetype_idxs = {archetype: idx for idx, archetype in enumerate(archetypes)}
+
+    # counts[d, a] is entries of archetype a on day d, prefix_sums[d] the sum of every day before day d
+    counts = np.zeros((max(days, 0), len(archetypes)), dtype=np.int64)
+    for date, archetype, amount in daily_counts:
+        counts[(date - start).days, archetype_idxs[archetype]] = amount
+    prefix_sums = np.zeros((counts.shape[0] + 1, len(archetypes)), dtype=np.int64)
+    np.cumsum(counts, axis=0, out=prefix_sums[1:])
+
+    rows = []
+    for day in range(length, counts.shape[0]):  # same days as au.date_range(start_date, end_date, length)
+        period_counts = prefix_sums[day + 1] - prefix_sums[day - length]
+        total = period_counts.sum()
+        present = np.flatnonzero(period_counts)
+        percents = (period_counts[present] / total) * 100
+        date = (start + dt.timedelta(days=day)).strftime('%Y-%m-%d')
+        day_rows = sorted(zip(percents.tolist(), (archetypes[idx] for idx in present)), key=lambda x: (-x[0], x[1]))
+        rows.extend((date, archetype, percent) for percent, archetype in day_rows)
+
     data_frame = pd.DataFrame(columns=['date', 'archetype', 'percentage'], data=rows)
     data_frame['date'] = pd.to_datetime(data_frame['date'])  # set as date type
     data_frame = data_frame.set_index(pd.DatetimeIndex(data_frame['date']))
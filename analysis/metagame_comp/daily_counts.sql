@@ -0,0 +1,4 @@
+SELECT dac.date date, dac.archetype archetype, dac.amount amount
+FROM events.daily_archetype_counts dac
+WHERE dac.date BETWEEN %(start)s::date AND %(end)s::date
+  AND dac.format = %(format)s
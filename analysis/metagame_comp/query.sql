@@ -1,19 +1,14 @@
-WITH FilteredResults AS (
-    SELECT ee.archetype archetype, ee.entry_id id
-    FROM events.event_entry ee
-        JOIN events.event_info ei ON ei.tourny_id = ee.tourny_id
-    WHERE ei.date BETWEEN (DATE '{date}' - INTEGER '{length}') AND DATE '{date}'
-      AND ei.format = '{format}'
-    ),
-     ArchetypeCounts AS (
-         SELECT fr.archetype, COUNT(fr.id) amount
-         FROM FilteredResults fr
-         GROUP BY fr.archetype
+WITH ArchetypeCounts AS (
+         SELECT dac.archetype archetype, SUM(dac.amount) amount
+         FROM events.daily_archetype_counts dac
+         WHERE dac.date BETWEEN (%(date)s::date - %(length)s::integer) AND %(date)s::date
+           AND dac.format = %(format)s
+         GROUP BY dac.archetype
     ),
      TotalCount AS (
-         SELECT COUNT(*) total
-         FROM FilteredResults
+         SELECT SUM(ac.amount) total
+         FROM ArchetypeCounts ac
     )
 SELECT ac.archetype archetype, (CAST(ac.amount AS FLOAT) / CAST(tc.total AS FLOAT)) * 100 percent
 FROM ArchetypeCounts ac CROSS JOIN TotalCount tc
-ORDER BY percent DESC
\ No newline at end of file
+ORDER BY percent DESC, archetype
\ No newline at end of file
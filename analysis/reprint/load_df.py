@@ -2,6 +2,23 @@ import pandas as pd
 import analysis.utility as u
 
 
+def get_snapshot_price_and_reprint_info(card: str, paper_prices: bool) -> pd.DataFrame:
+    """Retrieves the rows query.sql would from the current snapshot, joining the same tables its rollup is built from
+    :param card: name of card
+    :param paper_prices: to retrieve paper or online prices
+    :return: DataFrame of the prices, set names, release dates, and rarities of each printing of the card
+    """
+    prices = u.load_table('prices', 'pricing')
+    prices = prices[(prices['card'] == card) & (prices['is_paper'] == paper_prices)]
+    printings = u.load_table('cards', 'printings')
+    printings = printings[printings['card'] == card]
+    sets = u.load_table('cards', 'set_info')
+    data_frame = u.decode_categoricals(prices).merge(u.decode_categoricals(printings), on=['card', 'set']) \
+        .merge(u.decode_categoricals(sets), on='set')
+    return data_frame.drop(columns='set').rename(columns={'date': 'price_date', 'full_name': 'set',
+                                                          'release': 'release_date'})
+
+
 def get_price_and_reprint_info(card: str, paper_prices: bool) -> pd.DataFrame:
     """Retrieves a DataFrame of all the prices associated with the given card, for all associated printings with
     scrapped prices
@@ -9,13 +26,13 @@ def get_price_and_reprint_info(card: str, paper_prices: bool) -> pd.DataFrame:
     :param paper_prices: to retrieve paper or online prices
     :return: DataFrame of all pricing info associated with the given card in the database
     """
-    paper = 't' if paper_prices else 'f'
-    query = u.load_query('query.sql').format(card=card, paper=paper)
-    sql_data = u.generic_search(query)
-    data_frame = pd.DataFrame(sql_data, columns=['price_date', 'price', 'set', 'release_date', 'rarity'])
+    columns = ['price_date', 'price', 'set', 'release_date', 'rarity']
+    if u.using_snapshot():
+        data_frame = get_snapshot_price_and_reprint_info(card, paper_prices).reindex(columns=columns)
+    else:
+        data_frame = u.copy_search(u.load_query('query.sql'), {'card': card, 'paper': paper_prices}, columns)
     data_frame['price_date'] = pd.to_datetime(data_frame['price_date'])  # set as date type
     data_frame['release_date'] = pd.to_datetime(data_frame['release_date'])  # set as date type
-    data_frame['price'] = pd.to_numeric(data_frame['price'].apply(func=lambda x: x.replace('$', '')))  # money to float
     return data_frame
 
 
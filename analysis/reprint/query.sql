@@ -1,9 +1,6 @@
-SELECT pr.date, pr.price, s.full_name, s.release, pn.rarity
-FROM prices.pricing pr
+SELECT dpp.date, dpp.price, s.full_name, s.release, dpp.rarity
+FROM prices.daily_printing_prices dpp
     JOIN cards.set_info s
-        ON pr.set = s.set
-    JOIN cards.printings pn
-        ON s.set = pn.set
-        AND pn.card = pr.card
-WHERE pr.card = '{card}'
-AND pr.is_paper = '{paper}';
+        ON dpp.set = s.set
+WHERE dpp.card = %(card)s
+AND dpp.is_paper = %(paper)s;
\ No newline at end of file
@@ -0,0 +1,98 @@
+import argparse as ap
+import datetime as dt
+import os
+import pathlib as pl
+import time
+from typing import List, Tuple
+
+import pyarrow as pa
+from psycopg2 import sql
+
+import analysis.utility as au
+
+"""Exports a snapshot of the database the analyses can read from in place of the database, set with au.use_snapshot or
+SNAPSHOT_DIRC in the database config. Every table and rollup of the 'events' and 'cards' schemas is exported, along with
+prices.pricing, each to its own Arrow IPC file with text columns dictionary encoded. Scrapper state, such as the crawl
+progress of mtgtop8, is left out. Run as 'python -m analysis.snapshot snapshot_dirc'"""
+
+# Constants
+SNAPSHOT_SCHEMAS = ('events', 'cards')
+SNAPSHOT_TABLES = (('prices', 'pricing'),)
+EXCLUDED_TABLES = (('events', 'crawl_progress'),)
+BATCH_SIZE = 100000  # rows fetched at once when exporting
+
+
+def get_snapshot_tables(db_cursor) -> List[Tuple[str, str]]:
+    """
+    :param db_cursor: cursor to the database
+    :return: schema and name of every table and materialized view to export
+    """
+    db_cursor.execute("SELECT n.nspname, c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+                      "WHERE n.nspname = ANY(%s) AND c.relkind IN ('r', 'p', 'm') AND NOT c.relispartition "
+                      "ORDER BY n.nspname, c.relname", (list(SNAPSHOT_SCHEMAS),))
+    tables = [table for table in db_cursor.fetchall() if table not in EXCLUDED_TABLES]
+    return tables + list(SNAPSHOT_TABLES)
+
+
+def export_table(schema: str, table: str, snapshot_dirc: pl.Path) -> int:
+    """Exports a table to an Arrow IPC file under the given directory. Rows are fetched in batches from a server side
+    cursor, then each column is joined into a single array so text columns are dictionary encoded with one dictionary.
+    Written to a temporary file and then renamed, so a reader never sees a partial file.
+    :param schema: schema of the table
+    :param table: name of the table
+    :param snapshot_dirc: directory to export to
+    :return: number of rows exported
+    """
+    with au.pooled_connection() as con:
+        with con.cursor(name=f'snapshot_{schema}_{table}') as cursor:
+            cursor.itersize = BATCH_SIZE
+            cursor.execute(sql.SQL('SELECT * FROM {}').format(sql.Identifier(schema, table)))
+            rows = cursor.fetchmany(BATCH_SIZE)
+            names = [column.name for column in cursor.description]
+            types = [au.ARROW_TYPES.get(column.type_code, pa.string()) for column in cursor.description]
+
+            chunks = [[] for _ in names]
+            while rows:
+                for idx, values in enumerate(zip(*rows)):
+                    chunks[idx].append(pa.array(values, type=types[idx]))
+                rows = cursor.fetchmany(BATCH_SIZE)
+
+    columns = []
+    for column_type, column_chunks in zip(types, chunks):
+        column = pa.concat_arrays(column_chunks) if column_chunks else pa.array([], type=column_type)
+        columns.append(column.dictionary_encode() if column_type == pa.string() else column)
+    snapshot_table = pa.Table.from_arrays(columns, names=names)
+    snapshot_table = snapshot_table.replace_schema_metadata({'source': f'{schema}.{table}',
+                                                            'exported_at': dt.datetime.now().isoformat()})
+
+    path = au.get_snapshot_path(snapshot_dirc, schema, table)
+    temp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    with pa.OSFile(str(temp_path), 'wb') as sink:
+        writer = pa.ipc.new_file(sink, snapshot_table.schema)
+        writer.write_table(snapshot_table)
+        writer.close()
+    os.replace(temp_path, path)
+    return snapshot_table.num_rows
+
+
+def export_snapshot(snapshot_dirc: str) -> None:
+    """Exports a snapshot of the database under the given directory, reporting the rows and time taken for each table.
+    :param snapshot_dirc: directory to export to, created if needed
+    :return: None
+    """
+    snapshot_dirc = pl.Path(snapshot_dirc)
+    snapshot_dirc.mkdir(parents=True, exist_ok=True)
+    with au.pooled_connection() as con:
+        with con.cursor() as cursor:
+            tables = get_snapshot_tables(cursor)
+
+    for schema, table in tables:
+        start = time.perf_counter()
+        rows = export_table(schema, table, snapshot_dirc)
+        print(f'exported {rows} rows of {schema}.{table} in {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    parser = ap.ArgumentParser()
+    parser.add_argument('snapshot_dirc', help='directory to export the snapshot to')
+    export_snapshot(parser.parse_args().snapshot_dirc)
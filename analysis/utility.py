@@ -1,27 +1,303 @@
 import database.db_reader as ddr
-import psycopg2
+import psycopg2.extensions as pe
+import psycopg2.pool as pp
+import psycopg2.sql as sql
+import concurrent.futures as cf
+import contextlib as cl
+import functools as ft
+import io
+import itertools as it
+import os
+import re
+import threading as th
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pcsv
 import matplotlib.dates as mpd
 import pathlib as pl
-from typing import Union, List, Generator, Iterable
+from typing import Union, List, Generator, Iterable, Callable, Dict, Optional, Tuple, TypeVar
 import datetime as dt
 import pandas as pd
 
+"""Utility functions shared by the analysis scripts. Queries borrow connections from a process wide connection pool
+sized by the database config, take bind parameters in the form of '%(name)s', and may be prepared server side under a
+given name, so a query run many times in one analysis is only planned once per pooled connection. Large results can be
+streamed in typed DataFrame chunks or pulled in bulk with COPY. Analyses may instead read from a snapshot of the
+database exported by analysis.snapshot, set with use_snapshot or SNAPSHOT_DIRC in the database config, so they can run
+without the database."""
+
 # universal matplotlib plot args
 PLOT_ARGS = {'linestyle': '-', 'marker': ',', 'xdate': True}
 
+# Constants
+NAMED_PARAM_REGEX = re.compile(r'%\((\w+)\)s')
+# numeric values, such as prices, are read as floats rather than Decimals so they load straight into float64 arrays
+NUMERIC_AS_FLOAT = pe.new_type(pe.DECIMAL.values, 'NUMERIC_AS_FLOAT',
+                               lambda value, cursor: float(value) if value is not None else None)
+STREAM_CHUNK_SIZE = 50000  # rows fetched at once by a streaming search
+DATE_TYPE_OIDS = (1082, 1114)  # Postgres date and timestamp
+# Postgres type OIDs to their Arrow types, any other type (eg enums) is read as text
+ARROW_TYPES = {16: pa.bool_(), 20: pa.int64(), 21: pa.int32(), 23: pa.int32(), 700: pa.float64(),
+               701: pa.float64(), 1700: pa.float64(), 1082: pa.date32(), 1114: pa.timestamp('us')}
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+# created on first use, and again in any process forked after it was created
+POOL: Optional[pp.ThreadedConnectionPool] = None
+CURSOR_IDS = it.count()  # names each server side cursor uniquely within the process
+POOL_PID: Optional[int] = None
+POOL_LOCK = th.Lock()
+
+# directory of the snapshot analyses read from, the database if None
+SNAPSHOT_DIRC: Optional[pl.Path] = pl.Path(ddr.SNAPSHOT_DIRC) if ddr.SNAPSHOT_DIRC else None
+
+
+class PreparingConnection(pe.connection):
+    """Connection remembering the names of the statements prepared on it, which live as long as its session does.
+    Reads numeric values as floats."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        pe.register_type(NUMERIC_AS_FLOAT, self)
+
+
+def get_pool() -> pp.ThreadedConnectionPool:
+    """Returns this process's connection pool, creating it if needed.
+    :return: connection pool to the database
+    """
+    global POOL, POOL_PID
+    with POOL_LOCK:
+        if POOL is None or POOL_PID != os.getpid():  # a forked process can't share its parent's connections
+            POOL = pp.ThreadedConnectionPool(ddr.POOL_MIN_CONNECTIONS, ddr.POOL_MAX_CONNECTIONS, user=ddr.USER,
+                                             database=ddr.DATABASE_NAME, connection_factory=PreparingConnection)
+            POOL_PID = os.getpid()
+        return POOL
+
+
+def close_pool() -> None:
+    """Closes every connection in this process's connection pool, if it has been created.
+    :return: None
+    """
+    global POOL
+    with POOL_LOCK:
+        if POOL is not None and POOL_PID == os.getpid():
+            POOL.closeall()
+        POOL = None
+
+
+@cl.contextmanager
+def pooled_connection() -> Generator[PreparingConnection, None, None]:
+    """Borrows a connection from the connection pool for the length of a with block, committing on success and rolling
+    back on an error. The pool rolls back any transaction left open when the connection is returned.
+    :return: borrowed connection
+    """
+    pool = get_pool()
+    con = pool.getconn()
+    try:
+        with con:
+            yield con
+    finally:
+        pool.putconn(con)
+
+
+def to_prepared(search_query: str) -> Tuple[str, List[str]]:
+    """Converts a query taking bind parameters in the form of '%(name)s' into the positional parameters ('$1', '$2',
+    ...) of a server side prepared statement. Every use of a named parameter maps to the same position.
+    :param search_query: query to convert
+    :return: converted query, and the parameter name at each position
+    """
+    names = []
 
-def generic_search(search_query: str) -> List:
+    def to_position(match: re.Match) -> str:
+        if match.group(1) not in names:
+            names.append(match.group(1))
+        return f'${names.index(match.group(1)) + 1}'
+
+    return NAMED_PARAM_REGEX.sub(to_position, search_query).replace('%%', '%'), names
+
+
+def execute_prepared(cursor: pe.cursor, name: str, search_query: str, params: Optional[Dict]) -> None:
+    """Executes the given query as the server side prepared statement of the given name, preparing it first if it hasn't
+    been prepared on the cursor's connection yet.
+    :param cursor: cursor of a pooled connection
+    :param name: name of the prepared statement, unique to the query
+    :param search_query: query taking bind parameters in the form of '%(name)s'
+    :param params: values of the query's bind parameters
+    :return: None
+    """
+    prepared_query, names = to_prepared(search_query)
+    if name not in cursor.connection.prepared:
+        cursor.execute(sql.SQL('PREPARE {} AS ').format(sql.Identifier(name)) + sql.SQL(prepared_query))
+        cursor.connection.prepared.add(name)
+
+    execute = sql.SQL('EXECUTE {}').format(sql.Identifier(name))
+    if names:
+        execute += sql.SQL(' ({})').format(sql.SQL(', ').join(sql.Placeholder(param) for param in names))
+    cursor.execute(execute, params)
+
+
+def generic_search(search_query: str, params: Optional[Dict] = None, prepare_name: Optional[str] = None) -> List:
     """Generic function that executes a search query in the database and returns the results.
-    :param search_query: search query to execute
+    :param search_query: search query to execute, taking bind parameters in the form of '%(name)s'
+    :param params: values of the query's bind parameters, if any
+    :param prepare_name: name to prepare the query under server side, for queries run many times. Not prepared if None
     :return: results of search query
     """
-    with psycopg2.connect(user=ddr.USER, database=ddr.DATABASE_NAME) as con:
+    with pooled_connection() as con:
         with con.cursor() as cursor:
-            cursor.execute(search_query)
+            if prepare_name is None:
+                cursor.execute(search_query, params)
+            else:
+                execute_prepared(cursor, prepare_name, search_query, params)
             return cursor.fetchall()
 
 
+def to_typed_frame(rows: List[Tuple], names: List[str], type_codes: List[int]) -> pd.DataFrame:
+    """Builds a DataFrame from rows of query results, converting date and timestamp columns to datetime64 so callers
+    needn't convert them column by column.
+    :param rows: rows of query results
+    :param names: name of each column
+    :param type_codes: Postgres type OID of each column
+    :return: DataFrame of the rows
+    """
+    data_frame = pd.DataFrame.from_records(rows, columns=names, coerce_float=True)
+    for name, type_code in zip(names, type_codes):
+        if type_code in DATE_TYPE_OIDS:
+            data_frame[name] = pd.to_datetime(data_frame[name])
+    return data_frame
+
+
+def stream_search(search_query: str, params: Optional[Dict] = None, columns: Optional[List[str]] = None,
+                  chunk_size: int = STREAM_CHUNK_SIZE) -> Generator[pd.DataFrame, None, None]:
+    """Executes a search query on a server side cursor, yielding its results as typed DataFrames of at most 'chunk_size'
+    rows, so only a chunk of results is ever held as Python tuples. The pooled connection is held until the generator
+    is exhausted or closed.
+    :param search_query: search query to execute, taking bind parameters in the form of '%(name)s'
+    :param params: values of the query's bind parameters, if any
+    :param columns: names to give the result columns, the query's column names if None
+    :param chunk_size: max number of rows per chunk
+    :return: stream of DataFrames of results, none if there are no results
+    """
+    with pooled_connection() as con:
+        with con.cursor(name=f'stream_search_{next(CURSOR_IDS)}') as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(search_query, params)
+            rows = cursor.fetchmany(chunk_size)
+            names = columns if columns is not None else [column.name for column in cursor.description]
+            type_codes = [column.type_code for column in cursor.description]
+            while rows:
+                yield to_typed_frame(rows, names, type_codes)
+                rows = cursor.fetchmany(chunk_size)
+
+
+def search_frame(search_query: str, params: Optional[Dict] = None, columns: Optional[List[str]] = None) \
+        -> pd.DataFrame:
+    """Executes a search query, returning its results as a single typed DataFrame built up from streamed chunks.
+    :param search_query: search query to execute, taking bind parameters in the form of '%(name)s'
+    :param params: values of the query's bind parameters, if any
+    :param columns: names to give the result columns, the query's column names if None
+    :return: DataFrame of results, empty with the given column names if there are no results
+    """
+    chunks = list(stream_search(search_query, params, columns))
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=columns)
+
+
+def copy_search(search_query: str, params: Optional[Dict] = None, columns: Optional[List[str]] = None) \
+        -> pd.DataFrame:
+    """Executes a search query with COPY, for bulk pulls of many rows. Results are sent as CSV, parsed by Arrow's
+    multithreaded CSV reader into columns typed from the query's result types, rather than converted row by row into
+    Python tuples. Bind parameters are interpolated client side, as COPY doesn't take them.
+    :param search_query: search query to execute, taking bind parameters in the form of '%(name)s'
+    :param params: values of the query's bind parameters, if any
+    :param columns: names to give the result columns, the query's column names if None
+    :return: DataFrame of results
+    """
+    with pooled_connection() as con:
+        with con.cursor() as cursor:
+            query = cursor.mogrify(search_query, params).decode(pe.encodings[con.encoding]).strip().rstrip(';')
+            cursor.execute(f'SELECT * FROM ({query}) results LIMIT 0')
+            names = columns if columns is not None else [column.name for column in cursor.description]
+            types = [ARROW_TYPES.get(column.type_code, pa.string()) for column in cursor.description]
+
+            buffer = io.BytesIO()
+            cursor.copy_expert(f'COPY ({query}) TO STDOUT WITH (FORMAT csv)', buffer)
+
+    if buffer.tell() == 0:  # Arrow can't read an empty CSV file
+        table = pa.schema(list(zip(names, types))).empty_table()
+    else:
+        buffer.seek(0)
+        read_options = pcsv.ReadOptions(column_names=names)
+        convert_options = pcsv.ConvertOptions(column_types=dict(zip(names, types)), true_values=['t'],
+                                              false_values=['f'])
+        table = pcsv.read_csv(buffer, read_options=read_options, convert_options=convert_options)
+    return table.to_pandas(date_as_object=False)
+
+
+def run_concurrently(func: Callable[[T], R], items: Iterable[T], workers: Optional[int] = None) -> List[R]:
+    """Calls the given function on each item over a pool of threads, for running independent queries at the same time.
+    Queries release the GIL while waiting on the database, so threads suffice.
+    :param func: function to call on each item
+    :param items: items to call the function on
+    :param workers: number of threads to run, at most one per pooled connection - run serially if 1
+    :return: results of each call, in the order of the given items
+    """
+    # the pool raises rather than blocks when every connection is borrowed
+    workers = ddr.POOL_MAX_CONNECTIONS if workers is None else min(workers, ddr.POOL_MAX_CONNECTIONS)
+    if workers <= 1:
+        return [func(item) for item in items]
+    with cf.ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, items))
+
+
+def use_snapshot(snapshot_dirc: Optional[Union[str, pl.Path]]) -> None:
+    """Sets the data source of every analysis in this process.
+    :param snapshot_dirc: directory of a snapshot exported by analysis.snapshot, or None to read from the database
+    :return: None
+    """
+    global SNAPSHOT_DIRC
+    SNAPSHOT_DIRC = pl.Path(snapshot_dirc) if snapshot_dirc is not None else None
+    load_table.cache_clear()
+
+
+def using_snapshot() -> bool:
+    return SNAPSHOT_DIRC is not None
+
+
+def get_snapshot_path(snapshot_dirc: pl.Path, schema: str, table: str) -> pl.Path:
+    return snapshot_dirc / f'{schema}.{table}.arrow'
+
+
+@ft.lru_cache(maxsize=None)
+def load_table(schema: str, table: str) -> pd.DataFrame:
+    """Loads a table from the current snapshot, memory mapping its Arrow file. Dictionary encoded text columns load as
+    categoricals, so filtering on them compares integer codes, and dates load as datetime64 columns. Each table is only
+    loaded once per process, so must not be modified by callers.
+    :param schema: schema of the table
+    :param table: name of the table
+    :return: DataFrame of the table
+    """
+    if not using_snapshot():
+        raise ValueError('analyses are reading from the database, not a snapshot')
+
+    path = get_snapshot_path(SNAPSHOT_DIRC, schema, table)
+    if not path.is_file():
+        raise FileNotFoundError(f'{schema}.{table} is not in the snapshot under {SNAPSHOT_DIRC}')
+    source = pa.memory_map(str(path), 'r')  # left open, zero copy columns keep referencing the mapped file
+    return pa.ipc.open_file(source).read_all().to_pandas(date_as_object=False)
+
+
+def decode_categoricals(data_frame: pd.DataFrame) -> pd.DataFrame:
+    """Converts any categorical columns of the given DataFrame, such as those loaded from a snapshot, back into the
+    object columns of strings a query of the database returns.
+    :param data_frame: DataFrame to convert
+    :return: converted DataFrame
+    """
+    categoricals = data_frame.select_dtypes('category').columns
+    return data_frame.astype({column: object for column in categoricals})
+
+
 def load_query(path: Union[str, pl.Path]) -> str:
     """Loads the SQL query at the given path as a String
     :param path: path to the SQL file to load
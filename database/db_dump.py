@@ -1,32 +1,136 @@
+import argparse as ap
+import re
 import subprocess as sbp
-import zipfile as zp
+import time
+from contextlib import closing
+from typing import Dict, List, Optional
+
+import psycopg2
+
 import database.db_reader as dbr
+import database.migrate as m
 
-"""Module for creating a backup / text dump of the database based off of the given params"""
+"""Module for creating a backup of the database based off of the given params. Backups are directory format dumps
+written by parallel pg_dump jobs, one file per table compressed as it's written, and are restored in parallel by
+db_init. A 'schema' backup holds every table's definition but only the data of the migrations table, so the migrations
+it predates can still be told apart. A 'data' backup holds every table's data but the migrations', for loading into a
+database already at the same migration. Run as 'python -m database.db_dump'"""
 
+# Constants
+DEFAULT_BACKUP_DIRC = 'db_backup'
+DEFAULT_JOBS = 4
+DEFAULT_COMPRESSION = 6  # gzip level
+SECTIONS = ('full', 'schema', 'data')
+DATA_SCHEMAS = ('cards', 'events', 'prices')
+# tables recording the database's own state, not scrapped data
+STATE_TABLES = (f'public.{m.MIGRATIONS_TABLE}', f'public.{m.REFRESHES_TABLE}')
+# verbose pg_dump and pg_restore output, lines of parallel jobs may run together
+STARTED_REGEX = re.compile(r'(?:dumping contents of table|processing data for table) "([^"]+)"')
+FINISHED_REGEX = re.compile(r'finished item \d+ TABLE DATA (\S+)')
+ERROR_WORDS = ('error', 'warning', 'toc entry')
 
-def create_dump(db_name, backup_name, user):
-    """Creates a text dump of the given database as the given user, with the given file name. Used to create backups of
-    the desired database. Prints any errors that may occur during process.
-    :param db_name: name of the database to dump
-    :param backup_name: name of created dump file
+
+def get_section_args(section: str) -> List[str]:
+    """Returns the pg_dump arguments limiting a dump to the given section.
+    :param section: one of SECTIONS
+    :return: list of pg_dump arguments
+    """
+    if section == 'schema':
+        return [f'--exclude-table-data={schema}.*' for schema in DATA_SCHEMAS] + \
+               [f'--exclude-table-data=public.{m.REFRESHES_TABLE}']
+    elif section == 'data':
+        return ['--data-only'] + [f'--exclude-table-data={table}' for table in STATE_TABLES]
+    return []
+
+
+def count_tables(db_name: str, user: str) -> int:
+    """Returns the number of tables in the given database holding data, for reporting progress.
+    :param db_name: name of the database
     :param user: user to login into database as
-    :return: None
+    :return: number of tables
+    """
+    with closing(psycopg2.connect(user=user, dbname=db_name)) as con:
+        with con.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+                           "WHERE c.relkind = 'r' AND n.nspname NOT IN ('pg_catalog', 'information_schema') "
+                           "AND n.nspname NOT LIKE 'pg_toast%'")
+            return cursor.fetchone()[0]
+
+
+def run_with_progress(command: List[str], jobs: int, total: Optional[int], verb: str) -> int:
+    """Runs the given verbose pg_dump or pg_restore command, reporting how long the data of each table took to dump or
+    restore as it finishes. A single job doesn't report finishing a table, so a table is taken as finished once the next
+    one starts. Errors and warnings are printed as is.
+    :param command: command to run, must include '--verbose'
+    :param jobs: number of parallel jobs the command runs
+    :param total: number of tables the command will process, if known
+    :param verb: past tense of what's done to each table, for reporting
+    :return: return code of the command
     """
-    command = ['pg_dump', '-d', db_name, '-f', backup_name, '-U', user]
-    process = sbp.Popen(args=command, stdout=sbp.PIPE, stderr=sbp.PIPE)
+    start = time.perf_counter()
+    started: Dict[str, float] = {}
+    timings: Dict[str, float] = {}
+
+    def finish(table: str) -> None:
+        timings[table] = time.perf_counter() - started.pop(table)
+        count = f'{len(timings)}/{total}' if total is not None else str(len(timings))
+        print(f'[{count}] {verb} {table} in {timings[table]:.2f}s', flush=True)
+
+    process = sbp.Popen(args=command, stdout=sbp.PIPE, stderr=sbp.STDOUT, universal_newlines=True)
+    for line in process.stdout:
+        started_tables = STARTED_REGEX.findall(line)
+        finished_tables = FINISHED_REGEX.findall(line)
+        for table in started_tables:
+            if jobs == 1:
+                for prev_table in list(started):
+                    finish(prev_table)
+            started[table] = time.perf_counter()
+        for name in finished_tables:  # reported without their schema
+            matches = [table for table in started if table == name or table.endswith(f'.{name}')]
+            if matches:
+                finish(matches[0])
+        if not started_tables and not finished_tables and any(word in line.lower() for word in ERROR_WORDS):
+            print(line.rstrip(), flush=True)
     process.wait()
-    out, err = process.communicate()
 
-    out = out.decode('utf-8')
-    err = err.decode('utf-8')
+    for table in list(started):
+        finish(table)
+    slowest = sorted(timings.items(), key=lambda x: x[1], reverse=True)[:5]
+    print(f'{verb} {len(timings)} tables in {time.perf_counter() - start:.2f}s, slowest: '
+          + ', '.join(f'{table} {seconds:.2f}s' for table, seconds in slowest))
+    return process.returncode
 
-    print(err if process.returncode != 0 else out)
 
-    zip_file = backup_name.split('.')[0] + '.zip'
-    with zp.ZipFile(zip_file, 'w') as z:
-        z.write(backup_name)
+def create_dump(db_name: str, backup_dirc: str, user: str, jobs: int = DEFAULT_JOBS,
+                compression: int = DEFAULT_COMPRESSION, section: str = 'full') -> int:
+    """Creates a directory format dump of the given database as the given user, under the given directory. Used to
+    create backups of the desired database. Tables are dumped by parallel jobs, each compressing as it writes. Prints
+    the time taken to dump each table and any errors that may occur during process.
+    :param db_name: name of the database to dump
+    :param backup_dirc: directory to create the dump under, must not exist
+    :param user: user to login into database as
+    :param jobs: number of tables to dump at once
+    :param compression: gzip compression level, 0 for none
+    :param section: one of SECTIONS
+    :return: return code of pg_dump
+    """
+    command = ['pg_dump', '-d', db_name, '-U', user, '-F', 'd', '-f', backup_dirc, '-j', str(jobs),
+               '-Z', str(compression), '--verbose'] + get_section_args(section)
+    total = None  # only the migrations table's data is in a schema dump
+    if section != 'schema':
+        total = count_tables(db_name, user) - (len(STATE_TABLES) if section == 'data' else 0)
+    return run_with_progress(command, jobs, total, 'dumped')
 
 
 if __name__ == '__main__':
-    create_dump(dbr.DATABASE_NAME, 'db_backup.sql', dbr.USER)
+    parser = ap.ArgumentParser()
+    parser.add_argument('-f', default=DEFAULT_BACKUP_DIRC, help='directory to create the dump under')
+    parser.add_argument('-j', default=DEFAULT_JOBS, type=int, help='number of tables to dump at once')
+    parser.add_argument('-Z', default=DEFAULT_COMPRESSION, type=int, choices=range(10), help='gzip compression level')
+    sections = parser.add_mutually_exclusive_group()
+    sections.add_argument('-s', action='store_true', help='dump schema and migration history only')
+    sections.add_argument('-a', action='store_true', help='dump data only')
+    args = parser.parse_args()
+
+    dump_section = 'schema' if args.s else 'data' if args.a else 'full'
+    create_dump(dbr.DATABASE_NAME, args.f, dbr.USER, args.j, args.Z, dump_section)
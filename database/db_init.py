@@ -1,28 +1,56 @@
+import argparse as ap
+import os
 import psycopg2
-import sys
+import tempfile
+from contextlib import closing
 from psycopg2 import sql
+from typing import List
+import database.db_dump as dd
 import database.db_reader as r
+import database.migrate as m
 import subprocess as sbp
 
 """Module for creating a new instance of the database this project interpoles with"""
 
+# Constants
+DATA_KINDS = ('TABLE DATA', 'SEQUENCE SET', 'MATERIALIZED VIEW DATA')  # table of contents entries in a dump's data
 
-def create_new_db(db_schema: str, replace_existing: bool) -> None:
-    """Creates a new instance of a this project's database, using the information from this project's config file and
-    the given database schema. Note the option to replace any existing database with the name the created database will
-    be given (i.e. prior versions of this project's database).
-    :param db_schema: path to the schema file of the database
+
+def filter_toc(toc: str, section: str) -> List[str]:
+    """Filters the table of contents of a directory format dump down to the entries restoring the given section. A
+    'schema' restore keeps the data of the migrations table, so the migrations the dump predates can still be applied.
+    A 'data' restore leaves out the data of the tables recording the database's own state, and of the rollups which are
+    refreshed afterwards.
+    :param toc: table of contents, as listed by 'pg_restore -l'
+    :param section: one of dd.SECTIONS
+    :return: entries of the table of contents to restore
+    """
+    entries = [line for line in toc.splitlines() if line.strip() and not line.startswith(';')]
+    is_data = lambda entry: any(f' {kind} ' in entry for kind in DATA_KINDS)
+    is_state = lambda entry: any(f' TABLE DATA {table.replace(".", " ")} ' in entry for table in dd.STATE_TABLES)
+    is_migrations = lambda entry: f' TABLE DATA public {m.MIGRATIONS_TABLE} ' in entry
+    if section == 'schema':
+        return [entry for entry in entries if not is_data(entry) or is_migrations(entry)]
+    elif section == 'data':
+        return [entry for entry in entries
+                if is_data(entry) and not is_state(entry) and ' MATERIALIZED VIEW DATA ' not in entry]
+    return entries
+
+
+def create_db(replace_existing: bool) -> None:
+    """Creates a new, empty database with the name from this project's config file. Note the option to replace any
+    existing database with the same name (i.e. prior versions of this project's database).
     :param replace_existing: whether or not to replace a database with the name the new database will be initalized with
     :return: None
     """
     # create connection, set isolation level to create db, and create cursor
-    with psycopg2.connect(user=r.USER, password=r.PASSWORD) as con:
+    with closing(psycopg2.connect(user=r.USER, password=r.PASSWORD)) as con:
         con.autocommit = True
         with con.cursor() as cursor:
             # remove all other active sessions
             remove_query = sql.SQL('SELECT pg_terminate_backend(pg_stat_activity.pid) '
                                    'FROM pg_stat_activity WHERE pg_stat_activity.datname = {} '
-                                   'AND pid <> pg_backend_pid()').format(sql.Identifier(r.DATABASE_NAME))
+                                   'AND pid <> pg_backend_pid()').format(sql.Literal(r.DATABASE_NAME))
             cursor.execute(remove_query)
 
             # delete database if it exists, create new one from init file
@@ -30,33 +58,90 @@ def create_new_db(db_schema: str, replace_existing: bool) -> None:
                 cursor.execute(sql.SQL('DROP DATABASE IF EXISTS {}').format(sql.Identifier(r.DATABASE_NAME)))
             cursor.execute(sql.SQL('CREATE DATABASE {}').format(sql.Identifier(r.DATABASE_NAME)))
 
-    # open connection to new database and insert schema
-    command = ['psql', '-d', 'mtg_analysis', '-f', db_schema]
+
+def load_sql_file(db_schema: str) -> int:
+    """Loads a plain SQL file, such as the schema file, into the database with psql.
+    :param db_schema: path to the SQL file
+    :return: return code of psql
+    """
+    command = ['psql', '-d', r.DATABASE_NAME, '-U', r.USER, '-f', db_schema]
     process = sbp.Popen(args=command, stdout=sbp.PIPE, stderr=sbp.PIPE)
     process.wait()
     out, err = process.communicate()
     out = out.decode('utf-8')
     err = err.decode('utf-8')
     print(err if process.returncode != 0 else out)
+    return process.returncode
 
 
-if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        raise ValueError(f'usage {sys.argv[0]} blank_or_full_schema replace_if_existing')
+def restore_dump(dump_dirc: str, jobs: int = dd.DEFAULT_JOBS, section: str = 'full') -> int:
+    """Restores the given section of a directory format dump made by db_dump into the database, with tables restored by
+    parallel jobs. Prints the time taken to restore each table. Triggers are disabled while restoring only data, as
+    parallel jobs may load a table before the tables its foreign keys reference.
+    :param dump_dirc: directory of the dump
+    :param jobs: number of tables to restore at once
+    :param section: one of dd.SECTIONS
+    :return: return code of pg_restore
+    """
+    toc = sbp.run(['pg_restore', '-l', dump_dirc], stdout=sbp.PIPE, universal_newlines=True, check=True).stdout
+    entries = filter_toc(toc, section)
+    with tempfile.NamedTemporaryFile('w', suffix='.list') as list_file:
+        list_file.write('\n'.join(entries) + '\n')
+        list_file.flush()
+
+        command = ['pg_restore', '-d', r.DATABASE_NAME, '-U', r.USER, '-j', str(jobs), '-L', list_file.name,
+                   '--verbose', dump_dirc]
+        if section == 'data':
+            command.insert(-1, '--disable-triggers')
+        total = sum(' TABLE DATA ' in entry for entry in entries)
+        return dd.run_with_progress(command, jobs, total, 'restored')
 
-    if sys.argv[1] in ('true', 't'):
-        blank_or_full = True
-    elif sys.argv[1] in ('false', 'f'):
-        blank_or_full = False
-    else:
-        raise ValueError('blank_or_full_schema: true / t, false / f')
 
-    if sys.argv[2] in ('true', 't'):
-        replace_existing = True
-    elif sys.argv[2] in ('false', 'f'):
-        replace_existing = False
+def create_new_db(db_init_path: str, replace_existing: bool, jobs: int = dd.DEFAULT_JOBS, section: str = 'full') \
+        -> None:
+    """Creates a new instance of a this project's database, using the information from this project's config file and
+    the given database schema file or db_dump backup directory, then applies any migrations it predates. A 'data'
+    section is loaded into the existing database instead, which must be at the same migration as the backup.
+    :param db_init_path: path to the schema file of the database, or to a backup directory
+    :param replace_existing: whether or not to replace a database with the name the new database will be initalized with
+    :param jobs: number of tables to restore at once from a backup directory
+    :param section: one of dd.SECTIONS, for backup directories
+    :return: None
+    """
+    if section != 'data':
+        create_db(replace_existing)
+
+    if os.path.isdir(db_init_path):
+        return_code = restore_dump(db_init_path, jobs, section)
     else:
-        raise ValueError('replace_existing: true / t, false / f')
+        return_code = load_sql_file(db_init_path)
+
+    # bring the schema up to date with any migrations not in the schema file, then build the rollups they add
+    if return_code == 0:
+        m.migrate()
+        m.refresh_rollups()
+
+
+def str_to_bool(value: str) -> bool:
+    if value in ('true', 't'):
+        return True
+    elif value in ('false', 'f'):
+        return False
+    raise ap.ArgumentTypeError('must be one of true / t, false / f')
+
+
+if __name__ == '__main__':
+    parser = ap.ArgumentParser()
+    parser.add_argument('blank_or_full_schema', type=str_to_bool,
+                        help='true / t for a blank database from the schema file, false / f to restore a backup')
+    parser.add_argument('replace_if_existing', type=str_to_bool, help='true / t, false / f')
+    parser.add_argument('-f', default=None, help=f'backup to restore, {dd.DEFAULT_BACKUP_DIRC} if not given')
+    parser.add_argument('-j', default=dd.DEFAULT_JOBS, type=int, help='number of tables to restore at once')
+    sections = parser.add_mutually_exclusive_group()
+    sections.add_argument('-s', action='store_true', help='restore schema and migration history only')
+    sections.add_argument('-a', action='store_true', help='restore data only, into the existing database')
+    args = parser.parse_args()
 
-    init_schema = 'schema.sql' if blank_or_full else 'db_backup.sql'
-    create_new_db(init_schema, replace_existing)
+    init_path = 'schema.sql' if args.blank_or_full_schema else (args.f or dd.DEFAULT_BACKUP_DIRC)
+    restore_section = 'schema' if args.s else 'data' if args.a else 'full'
+    create_new_db(init_path, args.replace_if_existing, args.j, restore_section)
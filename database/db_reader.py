@@ -9,3 +9,6 @@ with open(config_path, 'r') as config:
     DATABASE_NAME = db_info['DATABASE']
     USER = db_info['OWNER']
     PASSWORD = db_info['PASSWORD']
+    POOL_MIN_CONNECTIONS = db_info.get('POOL_MIN_CONNECTIONS', 1)
+    POOL_MAX_CONNECTIONS = db_info.get('POOL_MAX_CONNECTIONS', 8)
+    SNAPSHOT_DIRC = db_info.get('SNAPSHOT_DIRC')  # analyses read from the database if None
@@ -0,0 +1,146 @@
+import argparse as ap
+import pathlib as pl
+import re
+from contextlib import closing
+from typing import Dict, List, Tuple
+
+import psycopg2
+from psycopg2 import sql
+
+import database.db_reader as r
+
+"""Module for versioning the database's schema. Each file under 'migrations' named like '0001_description.sql' is a
+migration, applied in order of its version number at most once per database, with the versions applied so far recorded
+in the 'schema_migrations' table. Also refreshes the materialized rollups the analysis queries read, rebuilding only
+those with source tables that have been written to since their last refresh. Run as
+'python -m database.migrate migrate|refresh'"""
+
+# Constants
+MIGRATIONS_DIRC = pl.Path(__file__).parent / 'migrations'
+MIGRATION_FILE_REGEX = re.compile(r'^(\d+)_(\w+)\.sql$')
+MIGRATIONS_TABLE = 'schema_migrations'
+REFRESHES_TABLE = 'rollup_refreshes'
+# materialized rollup to the tables it's built from
+ROLLUPS = {('events', 'daily_archetype_counts'): (('events', 'event_info'), ('events', 'event_entry')),
+           ('prices', 'daily_printing_prices'): (('prices', 'pricing'), ('cards', 'printings'))}
+
+
+def get_migrations() -> List[Tuple[int, str, pl.Path]]:
+    """Returns every migration file under MIGRATIONS_DIRC, in the order they should be applied.
+    :return: list of version number, description, and path of each migration
+    """
+    migrations = []
+    for path in MIGRATIONS_DIRC.iterdir():
+        match = MIGRATION_FILE_REGEX.match(path.name)
+        if match is not None:
+            migrations.append((int(match.group(1)), match.group(2), path))
+
+    versions = [version for version, _, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f'migration version numbers under {MIGRATIONS_DIRC} must be unique')
+    return sorted(migrations)
+
+
+def get_applied_versions(db_cursor) -> Dict[int, str]:
+    """Returns the migrations applied to the database, creating the table recording them if it doesn't exist.
+    :param db_cursor: cursor to the database
+    :return: dictionary of applied version numbers to their descriptions
+    """
+    db_cursor.execute(sql.SQL('CREATE TABLE IF NOT EXISTS {} (version integer PRIMARY KEY, name text NOT NULL, '
+                              'applied_at timestamp without time zone DEFAULT now() NOT NULL)')
+                      .format(sql.Identifier(MIGRATIONS_TABLE)))
+    db_cursor.execute(sql.SQL('SELECT version, name FROM {}').format(sql.Identifier(MIGRATIONS_TABLE)))
+    return dict(db_cursor.fetchall())
+
+
+def migrate(database: str = r.DATABASE_NAME, user: str = r.USER) -> List[int]:
+    """Applies every migration not yet applied to the given database in order, each in its own transaction along with
+    the record of it being applied - so a failed migration leaves the database at the last migration that succeeded.
+    :param database: name of the database to migrate
+    :param user: user to login into the database as
+    :return: versions of the migrations applied
+    """
+    applied = []
+    with closing(psycopg2.connect(user=user, dbname=database)) as con:
+        with con:
+            with con.cursor() as cursor:
+                applied_versions = get_applied_versions(cursor)
+
+        for version, name, path in get_migrations():
+            if version in applied_versions:
+                continue
+
+            with con:
+                with con.cursor() as cursor:
+                    cursor.execute(path.read_text())
+                    cursor.execute(sql.SQL('INSERT INTO {} (version, name) VALUES (%s, %s)')
+                                   .format(sql.Identifier(MIGRATIONS_TABLE)), (version, name))
+            print(f'applied migration {version} {name}')
+            applied.append(version)
+    return applied
+
+
+def get_source_changes(rollup: Tuple[str, str], db_cursor) -> int:
+    """Returns the number of rows ever inserted, updated, or deleted across the given rollup's source tables, as counted
+    by the statistics collector. Rows of a partitioned table are counted on its partitions. The count only needs to
+    differ from the one recorded at the rollup's last refresh, so a reset of the statistics causes one extra refresh.
+    :param rollup: schema and name of the rollup
+    :param db_cursor: cursor to the database
+    :return: count of changed rows
+    """
+    sources = [f'{schema}.{table}' for schema, table in ROLLUPS[rollup]]
+    db_cursor.execute('WITH RECURSIVE sources AS (SELECT unnest(%s::regclass[])::oid relid UNION '
+                      'SELECT inh.inhrelid FROM pg_inherits inh JOIN sources ON inh.inhparent = sources.relid) '
+                      'SELECT COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0) '
+                      'FROM pg_stat_user_tables stats JOIN sources ON stats.relid = sources.relid', (sources,))
+    return int(db_cursor.fetchone()[0])
+
+
+def refresh_rollups(database: str = r.DATABASE_NAME, user: str = r.USER, force: bool = False) -> List[str]:
+    """Refreshes each rollup with source tables changed since its last refresh, concurrently so analyses reading it
+    aren't blocked. Changes are counted before refreshing, so anything written during a refresh is picked up by the next
+    one. Statistics are reported by each session as it goes idle, so a scrape still running may not be counted yet.
+    :param database: name of the database holding the rollups
+    :param user: user to login into the database as
+    :param force: whether to refresh every rollup, changed or not
+    :return: names of the rollups refreshed
+    """
+    refreshed = []
+    with closing(psycopg2.connect(user=user, dbname=database)) as con:
+        for rollup in ROLLUPS:
+            name = '.'.join(rollup)
+            with con:
+                with con.cursor() as cursor:
+                    changes = get_source_changes(rollup, cursor)
+                    cursor.execute(sql.SQL('SELECT source_changes FROM {} WHERE rollup = %s')
+                                   .format(sql.Identifier(REFRESHES_TABLE)), (name,))
+                    last_refresh = cursor.fetchone()
+                    if not force and last_refresh is not None and last_refresh[0] == changes:
+                        continue
+
+                    cursor.execute('SELECT ispopulated FROM pg_matviews WHERE schemaname = %s AND matviewname = %s',
+                                   rollup)
+                    concurrently = sql.SQL('CONCURRENTLY ' if cursor.fetchone()[0] else '')
+                    cursor.execute(sql.SQL('REFRESH MATERIALIZED VIEW {}{}')
+                                   .format(concurrently, sql.Identifier(*rollup)))
+                    cursor.execute(sql.SQL('INSERT INTO {} (rollup, source_changes) VALUES (%s, %s) '
+                                           'ON CONFLICT (rollup) DO UPDATE '
+                                           'SET source_changes = EXCLUDED.source_changes, refreshed_at = now()')
+                                   .format(sql.Identifier(REFRESHES_TABLE)), (name, changes))
+            print(f'refreshed {name}')
+            refreshed.append(name)
+    return refreshed
+
+
+if __name__ == '__main__':
+    parser = ap.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('migrate', help='apply every migration not yet applied')
+    refresh_parser = subparsers.add_parser('refresh', help='refresh rollups with changed source tables')
+    refresh_parser.add_argument('-f', action='store_true', help='refresh every rollup, changed or not')
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        migrate()
+    else:
+        refresh_rollups(force=args.f)
@@ -0,0 +1,18 @@
+-- Tables holding scrapper state, added to schema.sql after databases were already built from it
+
+CREATE TABLE IF NOT EXISTS prices.url_cache (
+    card text NOT NULL,
+    set text NOT NULL,
+    url text,
+    checked date NOT NULL,
+    retry_after date,
+    CONSTRAINT url_cache_pkey PRIMARY KEY (card, set)
+);
+
+CREATE TABLE IF NOT EXISTS events.crawl_progress (
+    format events.format NOT NULL,
+    page integer NOT NULL,
+    events_done integer NOT NULL,
+    completed_at timestamp without time zone,
+    CONSTRAINT crawl_progress_pkey PRIMARY KEY (format, page)
+);
@@ -0,0 +1,19 @@
+-- Covering indexes for the filters and joins of the analysis queries
+
+-- events of a format over a date range
+CREATE INDEX IF NOT EXISTS event_info_format_date_idx
+    ON events.event_info (format, date) INCLUDE (tourny_id);
+
+-- entries of an event, and entries of an archetype
+CREATE INDEX IF NOT EXISTS event_entry_tourny_id_idx
+    ON events.event_entry (tourny_id) INCLUDE (entry_id, archetype);
+CREATE INDEX IF NOT EXISTS event_entry_archetype_idx
+    ON events.event_entry (archetype) INCLUDE (tourny_id, entry_id);
+
+-- decks a card was played in
+CREATE INDEX IF NOT EXISTS entry_card_card_idx
+    ON events.entry_card (card) INCLUDE (entry_id, quantity);
+
+-- prices of a card, paper or online
+CREATE INDEX IF NOT EXISTS pricing_card_is_paper_date_idx
+    ON prices.pricing (card, is_paper, date) INCLUDE (set, price);
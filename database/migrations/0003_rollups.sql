@@ -0,0 +1,32 @@
+-- Materialized rollups read by the analysis queries, refreshed with 'python -m database.migrate refresh'. Each has a
+-- unique index so it can be refreshed concurrently, without blocking readers
+
+-- entries of each archetype on each day, per format
+CREATE MATERIALIZED VIEW IF NOT EXISTS events.daily_archetype_counts AS
+    SELECT ei.format format, ei.date date, ee.archetype archetype, COUNT(ee.entry_id) amount
+    FROM events.event_entry ee
+        JOIN events.event_info ei ON ei.tourny_id = ee.tourny_id
+    GROUP BY ei.format, ei.date, ee.archetype;
+
+CREATE UNIQUE INDEX IF NOT EXISTS daily_archetype_counts_format_date_archetype_idx
+    ON events.daily_archetype_counts (format, date, archetype) INCLUDE (amount);
+
+-- price of each printing on each day, for printings of known cards
+CREATE MATERIALIZED VIEW IF NOT EXISTS prices.daily_printing_prices AS
+    SELECT pr.card card, pr.set set, pr.is_paper is_paper, pr.date date, pr.price price, pn.rarity rarity
+    FROM prices.pricing pr
+        JOIN cards.printings pn
+            ON pn.card = pr.card
+            AND pn.set = pr.set;
+
+CREATE UNIQUE INDEX IF NOT EXISTS daily_printing_prices_card_is_paper_date_set_idx
+    ON prices.daily_printing_prices (card, is_paper, date, set);
+CREATE INDEX IF NOT EXISTS daily_printing_prices_card_date_idx
+    ON prices.daily_printing_prices (card, date) INCLUDE (price);
+
+-- statistics collector count of rows changed in each rollup's source tables at its last refresh
+CREATE TABLE IF NOT EXISTS public.rollup_refreshes (
+    rollup text PRIMARY KEY,
+    source_changes bigint NOT NULL,
+    refreshed_at timestamp without time zone DEFAULT now() NOT NULL
+);
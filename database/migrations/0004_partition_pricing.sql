@@ -0,0 +1,62 @@
+-- Stores prices as numeric rather than money, which is returned as a locale formatted string, and partitions
+-- prices.pricing into paper and online prices, each split by year, so scans over a date range skip the other years.
+-- Years outside those created here fall into each default partition
+
+DROP MATERIALIZED VIEW IF EXISTS prices.daily_printing_prices;
+
+ALTER TABLE prices.pricing RENAME TO pricing_money;
+ALTER TABLE prices.pricing_money RENAME CONSTRAINT pricing_unique TO pricing_money_unique;
+DROP INDEX IF EXISTS prices.pricing_card_is_paper_date_idx;
+
+CREATE TABLE prices.pricing (
+    card text NOT NULL,
+    set text NOT NULL,
+    date date NOT NULL,
+    price numeric(12, 2) NOT NULL,
+    is_paper boolean NOT NULL,
+    CONSTRAINT pricing_unique UNIQUE (card, set, date, is_paper)
+) PARTITION BY LIST (is_paper);
+
+ALTER TABLE prices.pricing OWNER TO postgres;
+
+CREATE TABLE prices.pricing_paper PARTITION OF prices.pricing FOR VALUES IN (true) PARTITION BY RANGE (date);
+CREATE TABLE prices.pricing_online PARTITION OF prices.pricing FOR VALUES IN (false) PARTITION BY RANGE (date);
+
+DO $$
+DECLARE
+    parent text;
+    year integer;
+BEGIN
+    FOREACH parent IN ARRAY ARRAY['pricing_paper', 'pricing_online'] LOOP
+        FOR year IN 2010..2035 LOOP
+            EXECUTE format('CREATE TABLE prices.%I PARTITION OF prices.%I FOR VALUES FROM (%L) TO (%L)',
+                           parent || '_' || year, parent, make_date(year, 1, 1), make_date(year + 1, 1, 1));
+        END LOOP;
+        EXECUTE format('CREATE TABLE prices.%I PARTITION OF prices.%I DEFAULT', parent || '_default', parent);
+    END LOOP;
+END
+$$;
+
+INSERT INTO prices.pricing (card, set, date, price, is_paper)
+    SELECT card, set, date, price::numeric, is_paper
+    FROM prices.pricing_money;
+
+DROP TABLE prices.pricing_money;
+
+CREATE INDEX pricing_card_is_paper_date_idx
+    ON prices.pricing (card, is_paper, date) INCLUDE (set, price);
+
+ANALYZE prices.pricing;
+
+-- recreated as in 0003, over the numeric prices
+CREATE MATERIALIZED VIEW prices.daily_printing_prices AS
+    SELECT pr.card card, pr.set set, pr.is_paper is_paper, pr.date date, pr.price price, pn.rarity rarity
+    FROM prices.pricing pr
+        JOIN cards.printings pn
+            ON pn.card = pr.card
+            AND pn.set = pr.set;
+
+CREATE UNIQUE INDEX daily_printing_prices_card_is_paper_date_set_idx
+    ON prices.daily_printing_prices (card, is_paper, date, set);
+CREATE INDEX daily_printing_prices_card_date_idx
+    ON prices.daily_printing_prices (card, date) INCLUDE (price);
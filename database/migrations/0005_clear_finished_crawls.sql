@@ -0,0 +1,4 @@
+-- A finished mtgtop8 crawl used to leave a checkpoint at page -1 making later runs skip its format until every format
+-- finished in one run. Finished crawls now just drop their checkpoints, so any such leftover markers are removed
+
+DELETE FROM events.crawl_progress WHERE page = -1;
@@ -180,6 +180,20 @@ CREATE TABLE cards.types (
 
 ALTER TABLE cards.types OWNER TO postgres;
 
+--
+-- Name: crawl_progress; Type: TABLE; Schema: events; Owner: postgres
+--
+
+CREATE TABLE events.crawl_progress (
+    format events.format NOT NULL,
+    page integer NOT NULL,
+    events_done integer NOT NULL,
+    completed_at timestamp without time zone
+);
+
+
+ALTER TABLE events.crawl_progress OWNER TO postgres;
+
 --
 -- Name: entry_card; Type: TABLE; Schema: events; Owner: postgres
 --
@@ -287,6 +301,21 @@ CREATE TABLE prices.pricing (
 
 ALTER TABLE prices.pricing OWNER TO postgres;
 
+--
+-- Name: url_cache; Type: TABLE; Schema: prices; Owner: postgres
+--
+
+CREATE TABLE prices.url_cache (
+    card text NOT NULL,
+    set text NOT NULL,
+    url text,
+    checked date NOT NULL,
+    retry_after date
+);
+
+
+ALTER TABLE prices.url_cache OWNER TO postgres;
+
 --
 -- Name: event_entry entry_id; Type: DEFAULT; Schema: events; Owner: postgres
 --
@@ -357,6 +386,14 @@ ALTER TABLE ONLY cards.types
     ADD CONSTRAINT type_pkey PRIMARY KEY (card, type);
 
 
+--
+-- Name: crawl_progress crawl_progress_pkey; Type: CONSTRAINT; Schema: events; Owner: postgres
+--
+
+ALTER TABLE ONLY events.crawl_progress
+    ADD CONSTRAINT crawl_progress_pkey PRIMARY KEY (format, page);
+
+
 --
 -- Name: entry_card entry_card_pkey; Type: CONSTRAINT; Schema: events; Owner: postgres
 --
@@ -405,6 +442,14 @@ ALTER TABLE ONLY prices.pricing
     ADD CONSTRAINT pricing_unique UNIQUE (card, set, date, is_paper);
 
 
+--
+-- Name: url_cache url_cache_pkey; Type: CONSTRAINT; Schema: prices; Owner: postgres
+--
+
+ALTER TABLE ONLY prices.url_cache
+    ADD CONSTRAINT url_cache_pkey PRIMARY KEY (card, set);
+
+
 --
 -- Name: entry_card entry_card_entry_id_fkey; Type: FK CONSTRAINT; Schema: events; Owner: postgres
 --
@@ -0,0 +1,203 @@
+import datetime as dt
+import gzip
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import pathlib as pl
+import threading as th
+import time
+import urllib.parse as up
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from scrapping.utility import RateLimiter
+
+"""Module providing an on-disk cache of HTTP responses shared by every scrapper. Responses are stored gzipped under a
+key hashed from the request's method, url, and form data. In 'online' mode a cached response is used while younger than
+the TTL given by the caller, else the request is sent and its response cached. In 'replay' mode every response comes
+from the cache and nothing is sent over the network, so the database can be rebuilt from a previous crawl. In 'off' mode
+the cache is bypassed."""
+
+# Constants
+MODE_ONLINE = 'online'
+MODE_REPLAY = 'replay'
+MODE_OFF = 'off'
+MODES = (MODE_ONLINE, MODE_REPLAY, MODE_OFF)
+DEFAULT_CACHE_DIRC = pl.Path(__file__).parent.parent / 'http_cache'
+CACHED_STATUSES = (200, 404)  # a 404 is as informative as a page, eg which MTGGoldfish url variants don't exist
+NOT_CACHED_STATUS = 504  # status of a response missing from the cache in replay mode
+NOT_CACHED_REASON = 'Not in HTTP cache'
+
+# set with configure before any worker processes are forked, so every worker inherits them
+MODE = MODE_ONLINE
+CACHE_DIRC = DEFAULT_CACHE_DIRC
+
+
+def configure(mode: str = MODE_ONLINE, cache_dirc: Optional[str] = None) -> None:
+    """Sets the cache mode and directory used by every scrapper in this process and any process forked from it.
+    :param mode: one of MODES
+    :param cache_dirc: directory to store cached responses in, DEFAULT_CACHE_DIRC if not given
+    :return: None
+    """
+    global MODE, CACHE_DIRC
+    if mode not in MODES:
+        raise ValueError(f'{mode} is an unsupported cache mode')
+    MODE = mode
+    CACHE_DIRC = DEFAULT_CACHE_DIRC if cache_dirc is None else pl.Path(cache_dirc)
+
+
+def is_replay() -> bool:
+    return MODE == MODE_REPLAY
+
+
+def is_missing_page(status: int) -> bool:
+    """Returns if a response status means the requested page doesn't exist, rather than that it couldn't be retrieved
+    right now. In replay mode a page missing from the cache is taken as missing, as it can't be retrieved at all.
+    :param status: status code of the response
+    :return: if the page is missing
+    """
+    return status == 404 or (is_replay() and status == NOT_CACHED_STATUS)
+
+
+def worker_count(default: int) -> int:
+    """Returns the number of worker processes a scrapper should run. Replaying from the cache is bound by parsing rather
+    than by the rate requests can be sent at, so spreads work over every core.
+    :param default: number of workers to run when sending requests
+    :return: number of workers to run
+    """
+    return max(default, mp.cpu_count()) if is_replay() else default
+
+
+def get_key(method: str, url: str, data: Optional[Dict] = None, json_data: Optional[Dict] = None) -> str:
+    """
+    :param method: HTTP method of the request
+    :param url: url of the request
+    :param data: form data sent with the request, if any
+    :param json_data: JSON body sent with the request, if any
+    :return: hex digest identifying the request
+    """
+    encoded_data = up.urlencode(sorted(data.items())) if data else ''
+    if json_data is not None:
+        encoded_data += json.dumps(json_data, sort_keys=True)
+    return hashlib.sha256('\n'.join((method.upper(), url, encoded_data)).encode('utf-8')).hexdigest()
+
+
+def get_path(key: str) -> pl.Path:
+    return CACHE_DIRC / key[:2] / f'{key}.gz'
+
+
+def make_response(url: str, status: int, reason: str, headers: Dict[str, str], content: bytes,
+                  encoding: Optional[str]) -> requests.Response:
+    response = requests.Response()
+    response.url = url
+    response.status_code = status
+    response.reason = reason
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = content
+    response.encoding = encoding
+    return response
+
+
+def load(key: str, ttl: Optional[dt.timedelta]) -> Optional[requests.Response]:
+    """Loads the cached response stored under the given key, if any and if younger than the given TTL. The TTL is
+    ignored in replay mode.
+    :param key: key of the request
+    :param ttl: max age of a usable response, None if responses never expire
+    :return: cached response, or None if there is no usable cached response
+    """
+    path = get_path(key)
+    try:
+        if ttl is not None and not is_replay() and time.time() - path.stat().st_mtime > ttl.total_seconds():
+            return None
+        with gzip.open(path, 'rb') as cache_file:
+            header = json.loads(cache_file.readline())
+            content = cache_file.read()
+    except (OSError, ValueError):  # missing, or partially written by a crashed process
+        return None
+    return make_response(header['url'], header['status'], header['reason'], header['headers'], content,
+                         header['encoding'])
+
+
+def store(key: str, url: str, status: int, reason: str, headers: Dict[str, str], content: bytes,
+          encoding: Optional[str]) -> None:
+    """Stores a response under the given key if its status is worth caching. Written to a temporary file and then
+    renamed, so workers reading the same key never see a partial response.
+    :param key: key of the request
+    :param url: url of the request
+    :param status: status code of the response
+    :param reason: reason phrase of the response
+    :param headers: headers of the response
+    :param content: body of the response
+    :param encoding: text encoding of the body
+    :return: None
+    """
+    if status not in CACHED_STATUSES:
+        return
+
+    path = get_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f'{path.name}.{os.getpid()}.{th.get_ident()}.tmp')  # unique per thread of each worker
+    header = {'url': url, 'status': status, 'reason': reason, 'encoding': encoding,
+              'headers': {'Content-Type': headers.get('Content-Type', '')}}
+    with gzip.open(temp_path, 'wb') as cache_file:
+        cache_file.write(json.dumps(header).encode('utf-8') + b'\n')
+        cache_file.write(content)
+    os.replace(temp_path, path)
+
+
+def lookup(method: str, url: str, data: Optional[Dict] = None, ttl: Optional[dt.timedelta] = None,
+           json_data: Optional[Dict] = None) -> Tuple[str, Optional[requests.Response]]:
+    """Looks up the cached response for a request, for callers that send requests themselves.
+    :param method: HTTP method of the request
+    :param url: url of the request
+    :param data: form data sent with the request, if any
+    :param json_data: JSON body sent with the request, if any
+    :param ttl: max age of a usable response, None if responses never expire
+    :return: key of the request, and its cached response - or a NOT_CACHED_STATUS response in replay mode if there is
+    none, else None if the request should be sent
+    """
+    key = get_key(method, url, data, json_data)
+    if MODE == MODE_OFF:
+        return key, None
+
+    response = load(key, ttl)
+    if response is None and is_replay():
+        response = make_response(url, NOT_CACHED_STATUS, NOT_CACHED_REASON, {}, b'', None)
+    return key, response
+
+
+def request(method: str, url: str, data: Optional[Dict] = None, ttl: Optional[dt.timedelta] = None,
+            rate_limiter: Optional[RateLimiter] = None, json_data: Optional[Dict] = None) -> requests.Response:
+    """Sends a request through the cache. Only waits on the given rate limiter when the request is actually sent.
+    :param method: HTTP method of the request
+    :param url: url of the request
+    :param data: form data to send with the request, if any
+    :param json_data: JSON body to send with the request, if any
+    :param ttl: max age of a usable cached response, None if responses never expire
+    :param rate_limiter: rate limiter to wait on before sending the request, if any
+    :return: cached or newly received response
+    """
+    key, response = lookup(method, url, data, ttl, json_data)
+    if response is not None:
+        return response
+
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    response = requests.request(method, url, data=data, json=json_data)
+    if MODE != MODE_OFF:
+        store(key, url, response.status_code, response.reason, response.headers, response.content,
+              response.encoding)
+    return response
+
+
+def get(url: str, ttl: Optional[dt.timedelta] = None, rate_limiter: Optional[RateLimiter] = None) \
+        -> requests.Response:
+    return request('GET', url, ttl=ttl, rate_limiter=rate_limiter)
+
+
+def post(url: str, data: Optional[Dict] = None, ttl: Optional[dt.timedelta] = None,
+         rate_limiter: Optional[RateLimiter] = None, json_data: Optional[Dict] = None) -> requests.Response:
+    return request('POST', url, data=data, ttl=ttl, rate_limiter=rate_limiter, json_data=json_data)
@@ -0,0 +1,174 @@
+import asyncio
+import concurrent.futures as cf
+import datetime as dt
+import logging as log
+import urllib.parse as up
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+
+import scrapping.http_cache as hc
+
+"""Module for fetching MTGGoldfish webpages concurrently from a single asyncio event loop, over a shared pool of
+keep-alive connections. Requests go through the HTTP cache like the blocking fetch path."""
+
+# Constants
+DEFAULT_CONCURRENCY = 100
+DEFAULT_REQUESTS_PER_SECOND = 10
+REQUEST_TIMEOUT = 60  # seconds
+KEEP_ALIVE_TIMEOUT = 30  # seconds
+CACHE_THREADS = 4  # threads reading and writing the HTTP cache, so its file IO and gzip work doesn't stall the loop
+
+
+class HostRateLimiter:
+    """Spaces out the start of requests to each host so that no host receives more than a given number of requests per
+    second, no matter how many requests are in flight at once."""
+
+    def __init__(self, requests_per_second: float) -> None:
+        self.interval = 1 / requests_per_second
+        self.next_slots: Dict[str, float] = {}
+
+    async def wait(self, url: str) -> None:
+        """Waits until a request to the host of the given url may be started.
+        :param url: url about to be requested
+        :return: None
+        """
+        host = up.urlsplit(url).netloc
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self.next_slots.get(host, now))
+        self.next_slots[host] = slot + self.interval  # reserve slot before sleeping, event loop is single threaded
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def lookup_cached(url: str, ttl: Optional[dt.timedelta]) -> Tuple[str, Optional[Tuple[int, str]]]:
+    """Looks up the cached response for a GET request of the given url, decoding its text.
+    :param url: url to request
+    :param ttl: max age of a usable cached response, None if responses never expire
+    :return: key of the request, and the status code and HTTP text of its cached response or None if not cached
+    """
+    key, cached = hc.lookup('GET', url, ttl=ttl)
+    return key, None if cached is None else (cached.status_code, cached.text)
+
+
+async def get_cached(session: aiohttp.ClientSession, limiter: HostRateLimiter, url: str,
+                     ttl: Optional[dt.timedelta], cache_threads: cf.Executor) -> Tuple[int, Optional[str]]:
+    """Sends a GET request for the given url through the HTTP cache, only waiting on the rate limiter if the request is
+    actually sent. Reading and writing the cache is done on the given threads rather than the event loop.
+    :param session: session holding the shared connection pool
+    :param limiter: rate limiter to wait on before sending the request
+    :param url: url to request
+    :param ttl: max age of a usable cached response, None if responses never expire
+    :param cache_threads: executor to read and write the cache on
+    :return: status code and HTTP text of the response
+    """
+    loop = asyncio.get_running_loop()
+    key, cached = await loop.run_in_executor(cache_threads, lookup_cached, url, ttl)
+    if cached is not None:
+        return cached
+
+    await limiter.wait(url)
+    async with session.get(url) as response:
+        content = await response.read()
+        encoding = response.get_encoding()
+        if hc.MODE != hc.MODE_OFF:
+            await loop.run_in_executor(cache_threads, hc.store, key, url, response.status, response.reason,
+                                       response.headers, content, encoding)
+        return response.status, content.decode(encoding, errors='replace')
+
+
+async def fetch_first_ok(session: aiohttp.ClientSession, limiter: HostRateLimiter, urls: List[Tuple[str, str]],
+                         name: str, logger: log.Logger, cache_threads: cf.Executor,
+                         ttl: Optional[dt.timedelta] = None) -> Tuple[Optional[str], Optional[str]]:
+    """Requests each of the given urls in order, returning the HTTP text of the first successful response.
+    :param session: session holding the shared connection pool
+    :param limiter: rate limiter to wait on before each request
+    :param urls: list of urls to try and their descriptions
+    :param name: name of the card being fetched, for logging
+    :param logger: logger to record any relevant information
+    :param cache_threads: executor to read and write the HTTP cache on
+    :param ttl: max age of a usable cached response, None if responses never expire
+    :return: HTTP text of the first successful response and its url, or None and None if every url is missing - any
+    other failure raises an error
+    """
+    statuses = []
+    for url, msg in urls:
+        status, text = await get_cached(session, limiter, url, ttl, cache_threads)
+        if status == 200:
+            logger.info(f'Got data for card {name} from {url} with parameters {msg}')
+            return text, url
+        statuses.append(status)
+
+    if not all(hc.is_missing_page(status) for status in statuses):
+        raise ConnectionError(f'Failed to fetch prices for card {name} from any of {len(urls)} urls, got statuses '
+                              f'{statuses}')
+    logger.error(f'Failed to fetch prices for card {name} from any of {len(urls)} urls')
+    return None, None
+
+
+async def fetch_all_async(entries: Iterable[Tuple[str, str, str]],
+                          get_urls: Callable[[str, str, str], List[Tuple[str, str]]],
+                          handle: Callable[[str, str, Optional[str], Optional[str]], None], logger: log.Logger,
+                          prod_mode: bool, concurrency: int, requests_per_second: float,
+                          ttl: Optional[dt.timedelta] = None) -> None:
+    """Fetches the webpage of each given card printing, with at most 'concurrency' printings being fetched at once.
+    Each fetched webpage is passed to the given handler, which is run on a single background thread so blocking work
+    such as database inserts doesn't stall the event loop.
+    :param entries: tuples of card name, printing abbreviation, and printing name to fetch
+    :param get_urls: function returning the urls to try for a card name, printing abbreviation, and printing name
+    :param handle: function called with card name, printing abbreviation, fetched HTTP text, and the url it was
+    fetched from (both None if every url is missing)
+    :param logger: logger to record any relevant information
+    :param prod_mode: boolean signifying production or testing mode
+    :param concurrency: max number of printings being fetched at once
+    :param requests_per_second: max number of requests sent to each host per second
+    :param ttl: max age of a usable cached response, None if responses never expire
+    :return: None
+    """
+    queue = asyncio.Queue()
+    for entry in entries:
+        queue.put_nowait(entry)
+
+    loop = asyncio.get_running_loop()
+    limiter = HostRateLimiter(requests_per_second)
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency,
+                                     keepalive_timeout=KEEP_ALIVE_TIMEOUT)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+
+    with cf.ThreadPoolExecutor(max_workers=1) as handler_thread, \
+            cf.ThreadPoolExecutor(max_workers=CACHE_THREADS) as cache_threads:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+
+            async def worker() -> None:
+                while not queue.empty():
+                    name, printing_code, printing = queue.get_nowait()
+                    try:
+                        data, url = await fetch_first_ok(session, limiter, get_urls(name, printing_code, printing),
+                                                         name, logger, cache_threads, ttl)
+                        await loop.run_in_executor(handler_thread, handle, name, printing_code, data, url)
+                    except Exception as e:
+                        if prod_mode:
+                            logger.warning(str(e))
+                        else:
+                            raise e
+
+            await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+
+def fetch_all(entries: Iterable[Tuple[str, str, str]], get_urls: Callable[[str, str, str], List[Tuple[str, str]]],
+              handle: Callable[[str, str, Optional[str], Optional[str]], None], logger: log.Logger,
+              prod_mode: bool, concurrency: int = DEFAULT_CONCURRENCY,
+              requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND, ttl: Optional[dt.timedelta] = None) -> None:
+    """Blocking entry point to fetch_all_async, runs it to completion on a new event loop.
+    :param entries: tuples of card name, printing abbreviation, and printing name to fetch
+    :param get_urls: function returning the urls to try for a card name, printing abbreviation, and printing name
+    :param handle: function called with card name, printing abbreviation, fetched HTTP text, and the url it was
+    fetched from (both None if every url is missing)
+    :param logger: logger to record any relevant information
+    :param prod_mode: boolean signifying production or testing mode
+    :param concurrency: max number of printings being fetched at once
+    :param requests_per_second: max number of requests sent to each host per second
+    :param ttl: max age of a usable cached response, None if responses never expire
+    :return: None
+    """
+    asyncio.run(fetch_all_async(entries, get_urls, handle, logger, prod_mode, concurrency, requests_per_second, ttl))
@@ -0,0 +1,236 @@
+import argparse as ap
+import datetime as dt
+import http.server as hs
+import logging as log
+import multiprocessing as mp
+import pathlib as pl
+import re
+import threading as th
+import time
+import tracemalloc
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import scrapping.http_cache as hc
+import scrapping.mtggoldfish.async_fetch as af
+import scrapping.mtggoldfish.pricing_data as p
+import scrapping.utility as su
+
+"""Benchmarks for the MTGGoldfish price scrapper. 'fetch' compares the process based and asyncio based fetch paths
+against a local stub HTTP server, so no requests are sent to MTGGoldfish itself. 'parse' compares the current and legacy
+price page parsers over a directory of saved MTGGoldfish pages, by default the ones under 'fixtures'. Run as
+'python -m scrapping.mtggoldfish.benchmark fetch|parse'"""
+
+# Constants
+FIXTURES_DIRC = pl.Path(__file__).parent / 'fixtures'
+STUB_HOST = '127.0.0.1'
+STUB_PRICING_URL = 'http://{}:{}/price/{}{}/{}#paper'
+LEGACY_DATE_PRICE_PATTERN = re.compile('d \\+?= "\\\\n[0-9]{4}-[0-9]{2}-[0-9]{2}, [0-9]+.[0-9]{1,2}";')
+LEGACY_DATE_PATTERN = re.compile('[0-9]{4}-[0-9]{2}-[0-9]{2}')
+LEGACY_PRICE_PATTERN = re.compile('[0-9]+.[0-9]{1,2}";$')
+BENCHMARK_LOGGER = log.getLogger(__name__)
+BENCHMARK_LOGGER.addHandler(log.NullHandler())
+BENCHMARK_LOGGER.propagate = False
+
+
+def make_price_page(days: int, start: str = '2015-01-01') -> str:
+    """Creates a fake MTGGoldfish printing webpage holding 'days' days of paper prices followed by 'days' days of online
+    prices, in the same format MTGGoldfish embeds them.
+    :param days: number of days of prices per series
+    :param start: first date of each series
+    :return: HTTP text of the fake webpage
+    """
+    start_date = dt.datetime.strptime(start, '%Y-%m-%d').date()
+    lines = ['<html><body><script>', 'var d = "Date,Price";']
+    for offset in (0, 1):  # paper then online series
+        for day in range(days):
+            date = (start_date + dt.timedelta(days=day)).isoformat()
+            lines.append(f'd += "\\n{date}, {(day % 500) / 10 + offset:.2f}";')
+    lines.append('</script></body></html>')
+    return '\n'.join(lines)
+
+
+def start_stub_server(days: int, latency: float, miss_rate: int) -> hs.ThreadingHTTPServer:
+    """Starts a keep-alive HTTP server on a background thread that answers every url with a fake price page after
+    'latency' seconds. The first url variants tried for a printing return 404s, between 0 and 'miss_rate' of them
+    decided by a hash of the card, mimicking printings that live under a later url variant on MTGGoldfish.
+    :param days: number of days of prices per series on each page
+    :param latency: seconds to wait before answering each request
+    :param miss_rate: max number of leading url variants per printing that 404
+    :return: running server, bound to a free port
+    """
+    page = make_price_page(days).encode('utf-8')
+
+    class StubHandler(hs.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep connections alive
+
+        def do_GET(self) -> None:
+            time.sleep(latency)
+            path = self.path.split('#')[0]
+            card = path.rsplit('/', 1)[-1]
+            variant = ('Foil' in path) * 2 + (not path.split('/')[2].startswith('Set+')) * 1
+            misses = zlib.crc32(card.encode('utf-8')) % (miss_rate + 1)
+            status, body = (404, b'') if variant < misses else (200, page)
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args) -> None:
+            pass
+
+    server = hs.ThreadingHTTPServer((STUB_HOST, 0), StubHandler)
+    server.daemon_threads = True
+    th.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def legacy_parse_printing_prices(data: Optional[str]) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Price page parser parse_printing_prices replaced, kept as a baseline. Runs three regexes and a strptime call per
+    price, returning dictionaries of dates to prices for paper and online prices.
+    """
+    if not data:
+        return {}, {}
+
+    paper_prices = {}
+    online_prices = {}
+    prev_date = None
+    for match in LEGACY_DATE_PRICE_PATTERN.findall(data):
+        date = LEGACY_DATE_PATTERN.search(match).group(0)
+        parsed_date = dt.datetime.strptime(date, '%Y-%m-%d')
+        price = LEGACY_PRICE_PATTERN.search(match).group(0)[:-2]
+        if prev_date is None or parsed_date > prev_date:
+            prev_date = parsed_date
+            paper_prices[date] = price
+        else:
+            online_prices[date] = price
+    return paper_prices, online_prices
+
+
+def load_pages(fixture_dirc: Optional[str], days: int) -> List[str]:
+    """Loads every saved page under the given directory, or creates ten fake pages if no directory given.
+    :param fixture_dirc: directory of saved MTGGoldfish printing pages, None for fake pages
+    :param days: days of prices per series on each fake page
+    :return: list of page HTTP texts
+    """
+    if fixture_dirc is None:
+        return [make_price_page(days, start=f'{2010 + idx}-01-01') for idx in range(10)]
+    return [path.read_text(encoding='utf-8') for path in sorted(pl.Path(fixture_dirc).iterdir()) if path.is_file()]
+
+
+def measure(parse: Callable[[str], Any], pages: List[str], repeats: int) -> Tuple[float, int]:
+    """Runs the given parser over every page, returning mean seconds per page and mean peak bytes allocated per page.
+    :param parse: parser to measure
+    :param pages: page HTTP texts to parse
+    :param repeats: number of times to parse every page when timing
+    :return: mean seconds per page and mean peak allocated bytes per page
+    """
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for page in pages:
+            parse(page)
+    seconds = (time.perf_counter() - start) / (repeats * len(pages))
+
+    peaks = 0
+    for page in pages:
+        tracemalloc.start()
+        parse(page)
+        peaks += tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, peaks // len(pages)
+
+
+def benchmark_parsers(pages: List[str], repeats: int) -> None:
+    """Checks the current parser agrees with the legacy parser on every page, then reports the parse time and peak
+    allocations per page of each.
+    :param pages: page HTTP texts to parse
+    :param repeats: number of times to parse every page when timing
+    :return: None
+    """
+    for idx, page in enumerate(pages):
+        paper, online = p.parse_printing_prices(page)
+        legacy_paper, legacy_online = legacy_parse_printing_prices(page)
+        for prices, legacy_prices in ((paper, legacy_paper), (online, legacy_online)):
+            parsed = dict(zip(prices['date'].tolist(), prices['price'].tolist()))
+            if parsed != {date: float(price) for date, price in legacy_prices.items()}:
+                print(f'page {idx}: parsers disagree')
+
+    prices_per_page = sum(sum(part.size for part in p.parse_printing_prices(page)) for page in pages) / len(pages)
+    print(f'{len(pages)} pages, {prices_per_page:.0f} prices per page')
+    for name, parse in (('current', p.parse_printing_prices), ('legacy', legacy_parse_printing_prices)):
+        seconds, peak = measure(parse, pages, repeats)
+        print(f'{name}: {seconds * 1000:.3f} ms per page, {peak / 1024:.1f} KiB peak allocated per page')
+
+
+def get_entries(count: int) -> List[Tuple[str, str, str]]:
+    return [(f'Card {idx}', f'ST{idx % 10}', f'Set {idx % 10}') for idx in range(count)]
+
+
+def fetch_and_parse(entry: Tuple[str, str, str]) -> None:
+    name, printing_code, printing = entry
+    p.get_printing_prices(name, printing_code, printing, BENCHMARK_LOGGER)
+
+
+def benchmark_processes(entries: List[Tuple[str, str, str]]) -> float:
+    """Fetches and parses the given printings with the process based fetch path, handing printings out one at a time
+    to a pool of worker processes.
+    :return: seconds taken
+    """
+    start = time.perf_counter()
+    with mp.Pool(p.WORKER_COUNT) as pool:
+        for _ in pool.imap_unordered(fetch_and_parse, entries, chunksize=1):
+            pass
+    return time.perf_counter() - start
+
+
+def benchmark_async(entries: List[Tuple[str, str, str]], logger: log.Logger, concurrency: int,
+                    requests_per_second: float) -> float:
+    """Fetches and parses the given printings with the asyncio based fetch path.
+    :return: seconds taken
+    """
+    def handle(name: str, printing_code: str, data: str, url: str) -> None:
+        p.parse_printing_prices(data)
+
+    start = time.perf_counter()
+    af.fetch_all(entries, p.get_mtggoldfish_urls, handle, logger, False, concurrency, requests_per_second)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = ap.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    fetch_parser = subparsers.add_parser('fetch', help='compare fetch paths against a stub server')
+    fetch_parser.add_argument('-n', default=400, type=int, help='number of printings to fetch')
+    fetch_parser.add_argument('-d', default=365, type=int, help='days of prices per page')
+    fetch_parser.add_argument('-l', default=.05, type=float, help='stub server latency in seconds')
+    fetch_parser.add_argument('-m', default=2, type=int, help='max number of 404 url variants per printing')
+    fetch_parser.add_argument('-c', default=af.DEFAULT_CONCURRENCY, type=int, help='async concurrency')
+    fetch_parser.add_argument('-r', default=1000, type=float, help='requests per second')
+
+    parse_parser = subparsers.add_parser('parse', help='compare price page parsers over saved pages')
+    parse_parser.add_argument('-f', default=str(FIXTURES_DIRC), help='directory of saved pages')
+    parse_parser.add_argument('-g', action='store_true', help='parse generated fake pages instead of saved pages')
+    parse_parser.add_argument('-d', default=2000, type=int, help='days of prices per series on fake pages')
+    parse_parser.add_argument('-r', default=5, type=int, help='times to parse every page when timing')
+    args = parser.parse_args()
+
+    if args.benchmark == 'parse':
+        benchmark_parsers(load_pages(None if args.g else args.f, args.d), args.r)
+        return
+
+    server = start_stub_server(args.d, args.l, args.m)
+    # point the scrapper at the stub server and give both paths the same rate cap, inherited by forked processes
+    p.MTGGOLDFISH_PRICING_URL = STUB_PRICING_URL.format(STUB_HOST, server.server_address[1], '{}', '{}', '{}')
+    p.RATE_LIMITER = su.RateLimiter(args.r)
+    hc.configure(hc.MODE_OFF)  # else the second path reads back the pages the first one cached
+
+    entries = get_entries(args.n)
+    for name, seconds in (('process', benchmark_processes(entries)),
+                          ('async', benchmark_async(entries, BENCHMARK_LOGGER, args.c, args.r))):
+        print(f'{name}: {args.n} printings in {seconds:.2f}s, {args.n / seconds:.1f} printings/s')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
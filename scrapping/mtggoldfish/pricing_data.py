@@ -1,26 +1,40 @@
+import argparse as ap
+import csv
 import datetime as dt
-import math as m
+import io
 import multiprocessing as mp
 import re
-from typing import List, Any, Tuple, Optional, Dict
+from contextlib import closing
+from typing import List, Tuple, Optional, Dict
 
+import numpy as np
 import psycopg2
-import requests
 from psycopg2 import sql
+from psycopg2.extras import execute_values
 
 import database.db_reader as dbr
+import scrapping.http_cache as hc
+import scrapping.mtggoldfish.async_fetch as af
 import scrapping.utility as su
 
 """Module for pulling all the pricing data available for each card and its associated printings in the database."""
 
 # Constants
 MTGGOLDFISH_PRICING_URL = 'https://www.mtggoldfish.com/price/{}{}/{}#paper'
-DATE_PRICE_PATTERN = re.compile('d \+?= "\\\\n[0-9]{4}-[0-9]{2}-[0-9]{2}, [0-9]+.[0-9]{1,2}";')
-DATE_PATTERN = re.compile('[0-9]{4}-[0-9]{2}-[0-9]{2}')
-PRICE_PATTERN = re.compile('[0-9]+.[0-9]{1,2}";$')
+DATE_PRICE_PATTERN = re.compile('d \\+?= "\\\\n([0-9]{4}-[0-9]{2}-[0-9]{2}), ([0-9]+\\.[0-9]{1,2})";')
+PRICE_DTYPE = np.dtype([('date', 'U10'), ('price', 'f8')])  # dates kept as "year-month-day" strings
 MAGIC_CORE_SET_PATTERN = re.compile('Magic 201[45]')
 EDITION_PATTERN = re.compile('(Modern Masters|Planechase) [0-9]{4}')
 WORKER_COUNT = 4
+REQUESTS_PER_SECOND = af.DEFAULT_REQUESTS_PER_SECOND  # combined across all workers
+RATE_LIMITER = su.RateLimiter(REQUESTS_PER_SECOND)
+MAX_RETRIES = 2
+PROGRESS_INTERVAL = 100  # printings processed between progress reports
+PRICE_BATCH_SIZE = 10000
+PRICE_STAGING_TABLE = 'pricing_staging'
+MISSING_PAGE_RETRY_DAYS = 30  # days to wait before searching again for a printing with no webpage
+FRESHNESS_DAYS = 1  # incremental mode only, skip printings with a price stored within this many days
+PRICE_PAGE_TTL = dt.timedelta(hours=20)  # prices are updated once a day
 
 
 def get_cards_and_printings(cursor):
@@ -42,31 +56,51 @@ def get_cards_and_printings(cursor):
     return cursor.fetchall()
 
 
-def insert_price_data(card, printing, price, date, is_paper, db_cursor, logger, prod_mode):
-    """Inserts the given instance of price data into the database of the associated cursor. An instance of price data is
-    the price for the printing of a card on a given date.
-    :param card: name of card
-    :param printing: set card was printed in
-    :param price: cost of the card's printing
-    :param date: when price was recorded
-    :param is_paper: is price for a paper printing or online printing
-    :param db_cursor: cursor of the database to retrieve data from
+def get_latest_price_dates(cursor) -> Dict[Tuple[str, str, bool], str]:
+    """Retrieves the date of the most recently stored price for every card, printing, and paper / online pairing in the
+    database associated with the given cursor.
+    :param cursor: cursor of the database to retrieve dates from
+    :return: dictionary of card name, set abbreviation, and if the price is for paper to latest date as "year-month-day"
+    """
+    select_query = sql.SQL('SELECT {}, {}, {}, MAX({}) FROM {} GROUP BY {}, {}, {}').format(
+        sql.Identifier('card'),
+        sql.Identifier('set'),
+        sql.Identifier('is_paper'),
+        sql.Identifier('date'),
+        sql.Identifier('prices', 'pricing'),
+        sql.Identifier('card'),
+        sql.Identifier('set'),
+        sql.Identifier('is_paper'))
+    cursor.execute(select_query)
+    return {(card, printing, is_paper): date.isoformat() for card, printing, is_paper, date in cursor.fetchall()}
+
+
+def get_entries_to_refresh(cursor, incremental: bool, freshness_days: int, logger) \
+        -> Tuple[List[Tuple[str, str, str]], Dict[Tuple[str, str, bool], str]]:
+    """Retrieves the card printings whose prices should be refreshed, and the latest stored price date of each. If not
+    incremental every printing is refreshed and no dates are returned, so every retrieved price is kept. If incremental,
+    printings whose latest stored price is less than 'freshness_days' days old are skipped.
+    :param cursor: cursor of the database to retrieve printings from
+    :param incremental: whether to only refresh prices newer than the ones already stored
+    :param freshness_days: days a printing's latest stored price stays fresh for, in incremental mode
     :param logger: logger to record any relevant info with
-    :return: None
+    :return: list of card name, set abbreviation, and set tuples - plus dictionary of latest stored price dates
     """
-    def price_insert_query():
-        insert_query = sql.SQL('INSERT INTO {} ({}, {}, {}, {}, {}) VALUES (%s, %s, %s, %s, %s)').format(
-            sql.Identifier('prices', 'pricing'),
-            sql.Identifier('card'),
-            sql.Identifier('set'),
-            sql.Identifier('date'),
-            sql.Identifier('price'),
-            sql.Identifier('is_paper'))
-        db_cursor.execute(insert_query, (card, printing, date, price, is_paper))
+    entries = get_cards_and_printings(cursor)
+    if not incremental:
+        return entries, {}
+
+    latest_dates = get_latest_price_dates(cursor)
+    fresh_date = (dt.date.today() - dt.timedelta(days=freshness_days - 1)).isoformat()
 
-    warning_msg = f'Duplicate price insertion into prices.printing for card {card} from printing {printing} on {date}'
-    logger.info(f'Inserting card price for card {card}, printing {printing} on {date}')
-    su.execute_query(price_insert_query, logger, warning_msg, prod_mode)
+    def is_fresh(name: str, printing_code: str) -> bool:
+        latest = max(latest_dates.get((name, printing_code, True), ''),
+                     latest_dates.get((name, printing_code, False), ''))
+        return latest >= fresh_date
+
+    stale_entries = [entry for entry in entries if not is_fresh(entry[0], entry[1])]
+    logger.info(f'Refreshing prices for {len(stale_entries)} of {len(entries)} printings')
+    return stale_entries, latest_dates
 
 
 def get_mtggoldfish_pricing_url(printing, card, foil):
@@ -111,14 +145,16 @@ def format_for_url(name: str) -> str:
     return ''.join(map(lambda x: '' if x in ("'", ',', ':', '/', '.') else x, name))
 
 
-def get_mtggoldfish_data(name: str, printing_abbrv: str, printing: str, logger) -> Optional[str]:
-    """Retrieves HTTP text from MTGGoldFish webpage for the printing of the given card, if such a webpage exists - else
-     returns None. Attempts several different URLs.
-    :param name: name of the card to retrieve
+def get_mtggoldfish_urls(name: str, printing_abbrv: str, printing: str, cached_url: Optional[str] = None) \
+        -> List[Tuple[str, str]]:
+    """Returns every MTGGoldfish url that may hold the webpage for the printing of the given card, in the order they
+    should be tried, each paired with a short description of the url's parameters. The url that held the webpage on a
+    previous run, if given, is tried first.
+    :param name: name of the card
     :param printing_abbrv: abbreviation of the card's printing
-    :param printing: printing of the card to retrieve data for
-    :param logger: logger to record any relevant information
-    :return: HTTP text of the card's printing on MTGGoldfish, or None
+    :param printing: printing of the card
+    :param cached_url: url that held the webpage on a previous run
+    :return: list of urls and their descriptions
     """
     formatted_name = format_for_url(name)
     formatted_printing = format_printing_name(printing)
@@ -128,109 +164,399 @@ def get_mtggoldfish_data(name: str, printing_abbrv: str, printing: str, logger)
             (get_mtggoldfish_pricing_url(printing_abbrv, formatted_name, False), 'printing abbreviation, non-foil'),
             (get_mtggoldfish_pricing_url(formatted_printing, formatted_name, True), 'printing, foil'),
             (get_mtggoldfish_pricing_url(printing_abbrv, formatted_name, True), 'printing abbreviation, foil')]
+    return sorted(urls, key=lambda url: url[0] != cached_url)  # stable, cached url first and rest in default order
+
 
-    for url, msg in urls:
-        response = requests.get(url)
+def get_mtggoldfish_data(name: str, printing_abbrv: str, printing: str, logger, cached_url: Optional[str] = None) \
+        -> Tuple[Optional[str], Optional[str]]:
+    """Retrieves HTTP text from MTGGoldFish webpage for the printing of the given card, if such a webpage exists - else
+     returns None. Attempts several different URLs, starting with the given cached url if any. Only taken as having no
+     webpage if every url is missing, any other failure such as being rate limited raises an error so the printing can
+     be tried again.
+    :param name: name of the card to retrieve
+    :param printing_abbrv: abbreviation of the card's printing
+    :param printing: printing of the card to retrieve data for
+    :param logger: logger to record any relevant information
+    :param cached_url: url that held the webpage on a previous run
+    :return: HTTP text of the card's printing on MTGGoldfish and the url it was retrieved from, or None and None
+    """
+    statuses = []
+    for url, msg in get_mtggoldfish_urls(name, printing_abbrv, printing, cached_url):
+        response = hc.get(url, PRICE_PAGE_TTL, RATE_LIMITER)
         if response.ok:
             logger.info(f'Got data for card {name} from {url} with parameters {msg}')
-            return response.text
+            return response.text, url
+        statuses.append(response.status_code)
 
+    if not all(hc.is_missing_page(status) for status in statuses):
+        raise ConnectionError(f'Failed to fetch prices for card {name} for printing {printing}, got statuses '
+                              f'{statuses}')
     logger.error(f'Failed to fetch prices for card {name} for printing {printing}')
-    return None
+    return None, None
 
 
-def get_printing_prices(card_name: str, printing_code: str, printing: str, logger) \
-        -> Tuple[Optional[Dict[str, str]], Optional[Dict[str, str]]]:
-    """Retrieves all prices for the given card printing, trying multiple different possible urls. Returns two
-    dictionaries of dates to prices, one for paper printings and one for online printings. If dict is empty, no prices
-    were retrieved.
+def get_printing_prices(card_name: str, printing_code: str, printing: str, logger) -> Tuple[np.ndarray, np.ndarray]:
+    """Retrieves all prices for the given card printing, trying multiple different possible urls. Returns two arrays of
+    dates and prices, one for paper printings and one for online printings. If an array is empty, no prices were
+    retrieved.
     :param card_name: name of the card to retrieve prices for
     :param printing_code: abbreviation of the printing from which prices are being retrieved for
     :param printing: printing from which prices are being retrieved for
     :param logger: logger to record any useful information
-    :return: dictionaries of dates to prices for any retrieved prices, for paper and online prices
+    :return: arrays of dates and prices for any retrieved prices, for paper and online prices
     """
     # try printing non-foil printing code non foil, printing foil, printing code foil
-    data = get_mtggoldfish_data(card_name, printing_code, printing, logger)
-
-    if not data:  # no data fetched, terminate early
-        return {}, {}
+    data, _ = get_mtggoldfish_data(card_name, printing_code, printing, logger)
+    return parse_printing_prices(data)
 
-    matches = DATE_PRICE_PATTERN.findall(data)
 
-    # separate paper and online prices, paper prices first
-    paper_prices = {}
-    online_prices = {}
-    prev_date = None
-    for match in matches:
-        date = DATE_PATTERN.search(match).group(0)
-        parsed_date = dt.datetime.strptime(date, '%Y-%m-%d')
-        price = PRICE_PATTERN.search(match).group(0)[:-2]  # get rid of "; in regex pattern
+def parse_printing_prices(data: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Parses the prices out of the HTTP text of a card printing's MTGGoldfish webpage in a single regex pass. Returns
+    two structured arrays of PRICE_DTYPE, one for paper printings and one for online printings.
+    :param data: HTTP text of a card printing's webpage, or None if no webpage was found
+    :return: arrays of dates and prices for any parsed prices, for paper and online prices
+    """
+    if not data:  # no data fetched, terminate early
+        empty = np.empty(0, dtype=PRICE_DTYPE)
+        return empty, empty
+
+    prices = np.array(DATE_PRICE_PATTERN.findall(data), dtype=PRICE_DTYPE)
+
+    # dates listed past to current in two groups for paper and online, first time the date "jumps down" is the start of
+    # the second (online) group - ISO dates compare correctly as strings, and a date may be listed twice in a row
+    dates = prices['date']
+    jumps = np.flatnonzero(dates[1:] < dates[:-1])
+    split = jumps[0] + 1 if jumps.size else prices.size
+    return prices[:split], prices[split:]
+
+
+def get_price_rows(name: str, printing_code: str, paper_prices: np.ndarray, online_prices: np.ndarray,
+                   latest_dates: Optional[Dict[Tuple[str, str, bool], str]] = None) \
+        -> List[Tuple[str, str, str, float, bool]]:
+    """Flattens the paper and online prices retrieved for a card printing into rows of the prices.pricing table, keeping
+    only prices dated after the latest stored price for the printing if latest stored dates are given.
+    :param name: name of the card
+    :param printing_code: abbreviation of the card's printing
+    :param paper_prices: array of PRICE_DTYPE holding paper prices
+    :param online_prices: array of PRICE_DTYPE holding online prices
+    :param latest_dates: dictionary of card name, set abbreviation, and if the price is for paper to latest stored date
+    :return: list of tuples of card name, printing abbreviation, date, price, and if the price is for paper
+    """
+    latest_dates = {} if latest_dates is None else latest_dates
+    rows = []
+    for prices, is_paper in ((paper_prices, True), (online_prices, False)):
+        latest = latest_dates.get((name, printing_code, is_paper))
+        if latest is not None:
+            prices = prices[prices['date'] > latest]
+        rows.extend((name, printing_code, date, price, is_paper)
+                    for date, price in zip(prices['date'].tolist(), prices['price'].tolist()))
+    return rows
+
+
+def copy_price_data(rows: List[Tuple[str, str, str, float, bool]], db_conn, logger) -> int:
+    """Bulk inserts the given rows of price data into the database of the given connection in a single transaction. Rows
+    are loaded with COPY into a temporary staging table then merged into prices.pricing, skipping any rows already
+    stored.
+    :param rows: list of tuples of card name, printing abbreviation, date, price, and if the price is for paper
+    :param db_conn: connection to the database to insert into, must not be in autocommit mode
+    :param logger: logger to record any relevant info with
+    :return: number of rows that were newly inserted
+    """
+    if not rows:
+        return 0
+
+    columns = sql.SQL(', ').join(map(sql.Identifier, ('card', 'set', 'date', 'price', 'is_paper')))
+    staging_table = sql.Identifier(PRICE_STAGING_TABLE)
+    create_query = sql.SQL('CREATE TEMPORARY TABLE IF NOT EXISTS {} (LIKE {}) ON COMMIT DELETE ROWS').format(
+        staging_table,
+        sql.Identifier('prices', 'pricing'))
+    copy_query = sql.SQL('COPY {} ({}) FROM STDIN WITH (FORMAT csv)').format(staging_table, columns)
+    merge_query = sql.SQL('INSERT INTO {} ({}) SELECT {} FROM {} ON CONFLICT ON CONSTRAINT {} DO NOTHING').format(
+        sql.Identifier('prices', 'pricing'),
+        columns,
+        columns,
+        staging_table,
+        sql.Identifier('pricing_unique'))
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    with db_conn:  # commits on success, staging table is emptied on commit
+        with db_conn.cursor() as cursor:
+            cursor.execute(create_query)
+            cursor.copy_expert(copy_query, buffer)
+            cursor.execute(merge_query)
+            inserted = cursor.rowcount
+
+    logger.info(f'Inserted {inserted} new prices out of {len(rows)} retrieved prices')
+    return inserted
+
+
+def store_batch(rows: List[Tuple[str, str, str, float, bool]],
+                url_rows: List[Optional[Tuple[str, str, Optional[str], str, Optional[str]]]], db_conn, logger) -> None:
+    """Stores a batch of retrieved prices and the urls their webpages were found at.
+    :param rows: list of tuples of card name, printing abbreviation, date, price, and if the price is for paper
+    :param url_rows: list of prices.url_cache rows, None for printings whose stored row is up to date
+    :param db_conn: connection to the database to insert into, must not be in autocommit mode
+    :param logger: logger to record any relevant info with
+    :return: None
+    """
+    copy_price_data(rows, db_conn, logger)
+    store_url_cache([url_row for url_row in url_rows if url_row is not None], db_conn)
 
-        # dates listed past to current in two groups for paper and online, when date "jumps down", have switched to
-        # the second (online) group
-        if prev_date is None or parsed_date > prev_date:
-            prev_date = parsed_date
-            paper_prices[date] = price
-        else:
-            online_prices[date] = price
 
-    return paper_prices, online_prices
+def get_url_cache(cursor) -> Dict[Tuple[str, str], Tuple[Optional[str], Optional[str]]]:
+    """Retrieves the MTGGoldfish url each card printing's webpage was found at on previous runs, from the database
+    associated with the given cursor.
+    :param cursor: cursor of the database to retrieve urls from
+    :return: dictionary of card name and set abbreviation to found url (None if no webpage exists) and the date as
+    "year-month-day" after which a printing with no webpage should be tried again
+    """
+    select_query = sql.SQL('SELECT {}, {}, {}, {} FROM {}').format(
+        sql.Identifier('card'),
+        sql.Identifier('set'),
+        sql.Identifier('url'),
+        sql.Identifier('retry_after'),
+        sql.Identifier('prices', 'url_cache'))
+    cursor.execute(select_query)
+    return {(card, printing): (url, None if retry_after is None else retry_after.isoformat())
+            for card, printing, url, retry_after in cursor.fetchall()}
 
 
-def divide_list(lst: List[Any], n: int) -> List[List[Any]]:
-    """Divides the given list into n even sized chunks (rounding up).
-    :param lst: list to divide
-    :param n: number of chunks
-    :return: divided list
+def remove_missing_pages(entries: List[Tuple[str, str, str]],
+                         url_cache: Dict[Tuple[str, str], Tuple[Optional[str], Optional[str]]], logger) \
+        -> List[Tuple[str, str, str]]:
+    """Removes every card printing known to have no MTGGoldfish webpage, whose retry date hasn't been reached yet.
+    :param entries: list of card name, set abbreviation, and set tuples
+    :param url_cache: dictionary of card name and set abbreviation to found url and retry date
+    :param logger: logger to record any relevant info with
+    :return: given entries without printings known to have no webpage
     """
-    n = m.ceil(len(lst) / n)
-    return [lst[i:i + n] for i in range(0, len(lst), n)]
+    today = dt.date.today().isoformat()
+
+    def is_missing(name: str, printing_code: str) -> bool:
+        url, retry_after = url_cache.get((name, printing_code), ('', None))
+        return url is None and retry_after is not None and retry_after > today
+
+    remaining = [entry for entry in entries if not is_missing(entry[0], entry[1])]
+    logger.info(f'Skipping {len(entries) - len(remaining)} printings known to have no MTGGoldfish webpage')
+    return remaining
+
+
+def get_url_cache_row(name: str, printing_code: str, url: Optional[str],
+                      url_cache: Dict[Tuple[str, str], Tuple[Optional[str], Optional[str]]]) \
+        -> Optional[Tuple[str, str, Optional[str], str, Optional[str]]]:
+    """Returns the row to store in prices.url_cache for a card printing after its webpage was searched for, or None if
+    the stored row is already up to date. Nothing is stored in replay mode, where a webpage missing from the HTTP cache
+    isn't known to be missing from MTGGoldfish.
+    :param name: name of the card
+    :param printing_code: abbreviation of the card's printing
+    :param url: url the webpage was found at, None if it wasn't found
+    :param url_cache: dictionary of card name and set abbreviation to found url and retry date
+    :return: tuple of card name, set abbreviation, url, checked date, and retry date - or None
+    """
+    if hc.is_replay() or (url is not None and url_cache.get((name, printing_code), (None, None))[0] == url):
+        return None
+    today = dt.date.today()
+    retry_after = None if url else (today + dt.timedelta(days=MISSING_PAGE_RETRY_DAYS)).isoformat()
+    return name, printing_code, url, today.isoformat(), retry_after
 
 
-def get_and_store_prices(database: str, user: str, prod_mode: bool) -> None:
+def store_url_cache(rows: List[Tuple[str, str, Optional[str], str, Optional[str]]], db_conn) -> None:
+    """Upserts the given rows into prices.url_cache in a single statement.
+    :param rows: list of tuples of card name, set abbreviation, url, checked date, and retry date
+    :param db_conn: connection to the database to insert into
+    :return: None
+    """
+    if not rows:
+        return
+
+    upsert_query = sql.SQL('INSERT INTO {} ({}, {}, {}, {}, {}) VALUES %s ON CONFLICT ({}, {}) DO UPDATE SET '
+                           '{} = EXCLUDED.{}, {} = EXCLUDED.{}, {} = EXCLUDED.{}').format(
+        sql.Identifier('prices', 'url_cache'),
+        sql.Identifier('card'),
+        sql.Identifier('set'),
+        sql.Identifier('url'),
+        sql.Identifier('checked'),
+        sql.Identifier('retry_after'),
+        sql.Identifier('card'),
+        sql.Identifier('set'),
+        sql.Identifier('url'), sql.Identifier('url'),
+        sql.Identifier('checked'), sql.Identifier('checked'),
+        sql.Identifier('retry_after'), sql.Identifier('retry_after'))
+
+    with db_conn:
+        with db_conn.cursor() as cursor:
+            execute_values(cursor, upsert_query, rows, page_size=len(rows))
+
+
+def get_and_store_prices(database: str, user: str, batch_size: int = PRICE_BATCH_SIZE, incremental: bool = False,
+                         freshness_days: int = FRESHNESS_DAYS, worker_count: int = WORKER_COUNT,
+                         max_retries: int = MAX_RETRIES) -> None:
     """For each card and its associated printings currently stored in the database, attempts to retrieve prices for each
-    card and printing pairing - then store them in the database.
+    card and printing pairing - then store them in the database. Printings are handed out one at a time from a shared
+    queue to a pool of worker processes, a printing that fails is put back on the queue until it has been retried
+    'max_retries' times.
     :param database: name of the database
     :param user: username to login into the database with
-    :param prod_mode: boolean signifying production or testing mode
+    :param batch_size: min number of retrieved prices to buffer before writing them to the database
+    :param incremental: only store prices newer than the latest stored price of each printing
+    :param freshness_days: in incremental mode, skip printings with a stored price less than this many days old
+    :param worker_count: number of worker processes
+    :param max_retries: number of times a failed printing is retried before being given up on
     :return: None
     """
-    def process(process_id: int, entries: List[Tuple[str, str, str]]) -> None:
-        # find prices for each one
-        logger = su.init_logging(f'mtgtop8_scrapper_{process_id}.log')
-        try:
-            for name, printing_code, printing in entries:
-                paper_prices, online_prices = get_printing_prices(name, printing_code, printing, logger)
-
-                # insert each price into database
-                for mapping, is_paper in ((paper_prices, True), (online_prices, False)):
-                    for date, price in mapping.items():
-                        insert_price_data(name, printing_code, price, date, is_paper, cursor, logger, prod_mode)
-        except Exception as e:
-            if prod_mode:
-                logger.warning(str(e))
+    def process(process_id: int) -> None:
+        logger = su.init_logging(f'mtggoldfish_scrapper_{process_id}.log')
+        rows, url_rows, buffered_tasks = [], [], []
+
+        def finish(finished_tasks: int, failed_tasks: int = 0) -> None:
+            with done.get_lock():
+                done.value += finished_tasks
+                failed.value += failed_tasks
+                done_count = done.value
+            if finished_tasks and (done_count // PROGRESS_INTERVAL > (done_count - finished_tasks) // PROGRESS_INTERVAL
+                                   or done_count == len(db_entries)):
+                logger.info(f'Processed {done_count} of {len(db_entries)} printings')
+
+        def retry(task: Tuple[str, str, str, int], error: Exception, can_retry: bool = True) -> None:
+            name, printing_code, printing, attempts = task
+            if can_retry and attempts < max_retries:
+                logger.warning(f'Retrying card {name} for printing {printing} after error: {error}')
+                tasks.put((name, printing_code, printing, attempts + 1))
             else:
-                raise e
+                logger.error(f'Giving up on card {name} for printing {printing} after error: {error}')
+                finish(1, 1)
+
+        def flush(can_retry: bool = True) -> None:
+            try:
+                store_batch(rows, url_rows, process_conn, logger)
+                finish(len(buffered_tasks))
+            except Exception as e:
+                for buffered_task in buffered_tasks:
+                    retry(buffered_task, e, can_retry)
+            rows.clear()
+            url_rows.clear()
+            buffered_tasks.clear()
+
+        with closing(psycopg2.connect(database=database, user=user)) as process_conn:
+            for task in iter(tasks.get, None):
+                name, printing_code, printing, _ = task
+                try:
+                    cached_url = url_cache.get((name, printing_code), (None, None))[0]
+                    data, url = get_mtggoldfish_data(name, printing_code, printing, logger, cached_url)
+                    paper_prices, online_prices = parse_printing_prices(data)
+                    rows.extend(get_price_rows(name, printing_code, paper_prices, online_prices, latest_dates))
+                    url_rows.append(get_url_cache_row(name, printing_code, url, url_cache))
+                    buffered_tasks.append(task)
+                    if len(rows) >= batch_size or tasks.empty():
+                        flush()
+                except Exception as e:
+                    retry(task, e)
+                finally:
+                    tasks.task_done()  # after any retry is queued, so the queue is never briefly empty
+            flush(can_retry=False)  # every task has been acknowledged, so nothing would take a retry off the queue
 
     with psycopg2.connect(database=database, user=user) as conn:
         conn.autocommit = True
         with conn.cursor() as cursor:
-            db_entries = get_cards_and_printings(cursor)
+            logger = su.init_logging('mtggoldfish_scrapper.log')
+            db_entries, latest_dates = get_entries_to_refresh(cursor, incremental, freshness_days, logger)
+            url_cache = get_url_cache(cursor)
+            db_entries = remove_missing_pages(db_entries, url_cache, logger)
+
+    tasks = mp.JoinableQueue()
+    for name, printing_code, printing in db_entries:
+        tasks.put((name, printing_code, printing, 0))
+    done = mp.Value('i', 0)
+    failed = mp.Value('i', 0)
 
-    chunked_entries = divide_list(db_entries, WORKER_COUNT)
-    processes = [mp.Process(target=process, args=(i, chunked_entries[i])) for i in range(WORKER_COUNT)]
+    processes = [mp.Process(target=process, args=(i,)) for i in range(hc.worker_count(worker_count))]
 
     for process in processes:
         process.start()
 
+    tasks.join()
+    for _ in processes:
+        tasks.put(None)  # one stop signal per worker
+
     for process in processes:
         process.join()
 
+    logger.info(f'Stored prices for {done.value - failed.value} of {len(db_entries)} printings, '
+                f'gave up on {failed.value}')
+    RATE_LIMITER.report(logger, 'mtggoldfish.com')
+
 
-def main(prod_mode: bool) -> None:
-    get_and_store_prices(dbr.DATABASE_NAME, dbr.USER, prod_mode)
+def get_and_store_prices_async(database: str, user: str, prod_mode: bool,
+                               concurrency: int = af.DEFAULT_CONCURRENCY,
+                               requests_per_second: float = af.DEFAULT_REQUESTS_PER_SECOND,
+                               batch_size: int = PRICE_BATCH_SIZE, incremental: bool = False,
+                               freshness_days: int = FRESHNESS_DAYS) -> None:
+    """Asynchronous version of get_and_store_prices, retrieves the prices of every card and printing pairing stored in
+    the database from a single process over a shared pool of keep-alive connections - then stores them in the database.
+    :param database: name of the database
+    :param user: username to login into the database with
+    :param prod_mode: boolean signifying production or testing mode
+    :param concurrency: max number of printings being fetched at once
+    :param requests_per_second: max number of requests sent to MTGGoldfish per second
+    :param batch_size: min number of retrieved prices to buffer before writing them to the database
+    :param incremental: only store prices newer than the latest stored price of each printing
+    :param freshness_days: in incremental mode, skip printings with a stored price less than this many days old
+    :return: None
+    """
+    logger = su.init_logging('mtggoldfish_async_scrapper.log')
+    with closing(psycopg2.connect(database=database, user=user)) as conn:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            db_entries, latest_dates = get_entries_to_refresh(cursor, incremental, freshness_days, logger)
+            url_cache = get_url_cache(cursor)
+            db_entries = remove_missing_pages(db_entries, url_cache, logger)
+        conn.autocommit = False
+
+        rows, url_rows = [], []
+
+        def get_urls(name: str, printing_code: str, printing: str) -> List[Tuple[str, str]]:
+            return get_mtggoldfish_urls(name, printing_code, printing,
+                                        url_cache.get((name, printing_code), (None, None))[0])
+
+        def store(name: str, printing_code: str, data: Optional[str], url: Optional[str]) -> None:
+            paper_prices, online_prices = parse_printing_prices(data)
+            rows.extend(get_price_rows(name, printing_code, paper_prices, online_prices, latest_dates))
+            url_rows.append(get_url_cache_row(name, printing_code, url, url_cache))
+            if len(rows) >= batch_size:
+                store_batch(rows, url_rows, conn, logger)
+                rows.clear()
+                url_rows.clear()
+
+        af.fetch_all(db_entries, get_urls, store, logger, prod_mode, concurrency, requests_per_second, PRICE_PAGE_TTL)
+        store_batch(rows, url_rows, conn, logger)
+
+
+def main(prod_mode: bool, fetch_mode: str = 'process', incremental: bool = False,
+         freshness_days: int = FRESHNESS_DAYS) -> None:
+    """Retrieves and stores the prices of every card printing in the database.
+    :param prod_mode: boolean signifying production or testing mode
+    :param fetch_mode: 'process' to fetch with multiple blocking processes, 'async' to fetch with a single asyncio
+    event loop
+    :param incremental: only store prices newer than the latest stored price of each printing
+    :param freshness_days: in incremental mode, skip printings with a stored price less than this many days old
+    :return: None
+    """
+    if fetch_mode == 'process':
+        get_and_store_prices(dbr.DATABASE_NAME, dbr.USER, incremental=incremental, freshness_days=freshness_days)
+    elif fetch_mode == 'async':
+        get_and_store_prices_async(dbr.DATABASE_NAME, dbr.USER, prod_mode, incremental=incremental,
+                                   freshness_days=freshness_days)
+    else:
+        raise ValueError(f'{fetch_mode} is an unsupported fetch mode')
 
 
 if __name__ == '__main__':
-    main(False)
+    parser = ap.ArgumentParser()
+    parser.add_argument('-m', default='process', choices=('process', 'async'), help='fetch mode')
+    parser.add_argument('-i', action='store_true', help='only store prices newer than the ones already stored')
+    parser.add_argument('-w', default=FRESHNESS_DAYS, type=int, help='days a stored price stays fresh for with -i')
+    args = parser.parse_args()
+    main(False, args.m, args.i, args.w)
@@ -0,0 +1,253 @@
+import argparse as ap
+import logging as log
+import pathlib as pl
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import scrapping.mtgtop8.parsing as prs
+
+"""Benchmarks for the mtgtop8 page parsers, run over a corpus of saved mtgtop8 pages. The corpus directory holds
+'format', 'event', and 'deck' subdirectories of saved format listing, event, and deck pages respectively. 'backends'
+runs the parsing functions with each available parser backend, checking every backend returns the same results as
+html.parser and reporting pages parsed per second and peak memory allocated per page. 'sections' checks the single pass
+section detection of deck and format pages returns the same results as the per row detection it replaced, and times
+both. 'check' only runs that comparison, exiting with an error if they differ. The corpus defaults to the small set of
+saved pages under 'fixtures'. Run as 'python -m scrapping.mtgtop8.benchmark backends|sections|check [corpus_dirc]'"""
+
+# Constants
+BASE_URL = 'https://www.mtgtop8.com/'
+FIXTURES_DIRC = pl.Path(__file__).parent / 'fixtures'
+PAGE_TYPES = ('format', 'event', 'deck')
+REFERENCE_BACKEND = 'html.parser'
+BENCHMARK_LOGGER = log.getLogger(__name__)
+BENCHMARK_LOGGER.addHandler(log.NullHandler())
+BENCHMARK_LOGGER.propagate = False
+
+
+def parse_format_page(markup: str, backend: str, parse_only: Any = None) -> Optional[List[Tuple[str, str, str]]]:
+    url_soup = prs.make_soup(markup, backend, parse_only)
+    return prs.get_events_from_page(url_soup, BASE_URL, BENCHMARK_LOGGER)
+
+
+def parse_event_page(markup: str, backend: str, parse_only: Any = None) -> Tuple[List[Tuple[str, ...]], int]:
+    url_soup = prs.make_soup(markup, backend, parse_only)
+    deck_parents, event_size = prs.get_event_info(url_soup)
+    return [prs.get_event_entry_info(parent) for parent in deck_parents], event_size
+
+
+def parse_deck_page(markup: str, backend: str, parse_only: Any = None) -> Tuple[List[Tuple[str, str, int]], str]:
+    url_soup = prs.make_soup(markup, backend, parse_only)
+    cards, deck_archetype = prs.get_entry_deck_info(url_soup)
+    return prs.get_cards_info(cards), deck_archetype
+
+
+PAGE_PARSERS = {'format': (parse_format_page, None),
+                'event': (parse_event_page, prs.EVENT_PAGE_STRAINER),
+                'deck': (parse_deck_page, None)}
+
+
+def get_available_backends() -> List[str]:
+    """Returns the parser backends installed in the current environment.
+    :return: list of usable parser backends
+    """
+    available = []
+    for backend in prs.PARSER_BACKENDS:
+        try:
+            prs.make_soup('<html></html>', backend)
+            available.append(backend)
+        except Exception:  # bs4.FeatureNotFound if the backend isn't installed
+            pass
+    return available
+
+
+def load_corpus(corpus_dirc: str) -> Dict[str, List[str]]:
+    """Loads every saved page under each page type subdirectory of the given directory.
+    :param corpus_dirc: directory holding 'format', 'event', and 'deck' subdirectories of saved pages
+    :return: dictionary of page type to the HTML texts of its pages
+    """
+    corpus = {}
+    for page_type in PAGE_TYPES:
+        page_dirc = pl.Path(corpus_dirc) / page_type
+        paths = sorted(page_dirc.iterdir()) if page_dirc.is_dir() else []
+        corpus[page_type] = [path.read_text(encoding='utf-8', errors='replace') for path in paths if path.is_file()]
+    return corpus
+
+
+def measure(parse: Callable[[str], Any], pages: List[str], repeats: int) -> Tuple[float, int]:
+    """Runs the given parser over every page, returning pages parsed per second and max peak bytes allocated per page.
+    :param parse: parser to measure
+    :param pages: page HTML texts to parse
+    :param repeats: number of times to parse every page when timing
+    :return: pages per second and max peak allocated bytes of any page
+    """
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for page in pages:
+            parse(page)
+    pages_per_second = (repeats * len(pages)) / (time.perf_counter() - start)
+
+    max_peak = 0
+    for page in pages:
+        tracemalloc.start()
+        parse(page)
+        max_peak = max(max_peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return pages_per_second, max_peak
+
+
+def benchmark_page_type(page_type: str, pages: List[str], backends: List[str], repeats: int) -> None:
+    """Checks each backend, with and without the page type's strainer if it has one, returns the same results as the
+    reference backend on every page, then reports the speed and peak memory of each.
+    :param page_type: one of PAGE_TYPES
+    :param pages: page HTML texts to parse
+    :param backends: parser backends to run
+    :param repeats: number of times to parse every page when timing
+    :return: None
+    """
+    parse, strainer = PAGE_PARSERS[page_type]
+    variants = [(backend, None) for backend in backends]
+    if strainer is not None:
+        variants += [(backend, strainer) for backend in backends]
+
+    expected = [parse(page, REFERENCE_BACKEND) for page in pages]
+    print(f'{page_type}: {len(pages)} pages')
+    for backend, parse_only in variants:
+        name = backend + (' + strainer' if parse_only is not None else '')
+        mismatches = [idx for idx, page in enumerate(pages) if parse(page, backend, parse_only) != expected[idx]]
+        if mismatches:
+            print(f'  {name}: results differ from {REFERENCE_BACKEND} on pages {mismatches}')
+            continue
+
+        pages_per_second, peak = measure(lambda page: parse(page, backend, parse_only), pages, repeats)
+        print(f'  {name}: {pages_per_second:.1f} pages/s, {peak / 1024:.1f} KiB peak allocated per page')
+
+
+def legacy_card_in_mainboard(card):
+    """Deck section detection get_cards_info replaced, kept as a baseline. Walks back over every sibling before the
+    card's parent, so is run in quadratic time over a deck.
+    """
+    for prev_sib in card.parent.previous_siblings:
+        has_class = prev_sib.find(class_='O13')
+        if has_class is not None:
+            title = has_class.get_text().lower()
+            if 'sideboard' in title:
+                return False
+    return True
+
+
+def legacy_get_cards_info(cards: List[Any]) -> List[Tuple[str, str, int]]:
+    return [prs.get_card_info(card, legacy_card_in_mainboard(card)) for card in cards]
+
+
+def legacy_get_normal_events(events: List[Any]) -> List[Any]:
+    """Major event detection get_events_from_page replaced, kept as a baseline. Stringifies every sibling before each
+    event row, so is run in quadratic time over a page.
+    """
+    normal_events = []
+    for parent in events:
+        major_event_header = any(['class="w_title"' in str(sibling) and 'Last major events' in str(sibling)
+                                  for sibling in parent.previous_siblings])
+        if not major_event_header:
+            normal_events.append(parent)
+    return normal_events
+
+
+def get_event_rows(url_soup: Any) -> List[Any]:
+    return [parent for parent in url_soup.find_all(class_='hover_tr') if parent.find(href=prs.EVENT_URL_REGEX)]
+
+
+def get_normal_events(events: List[Any]) -> List[Any]:
+    is_major_event = prs.tag_sections(events, prs.starts_major_events)
+    return [event for event, is_major in zip(events, is_major_event) if not is_major]
+
+
+def time_per_page(func: Callable[[Any], Any], inputs: List[Any], repeats: int) -> float:
+    """
+    :return: mean milliseconds taken per input
+    """
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for page_input in inputs:
+            func(page_input)
+    return (time.perf_counter() - start) * 1000 / (repeats * len(inputs))
+
+
+def get_section_comparisons(corpus: Dict[str, List[str]]) -> List[Tuple[str, List[Any], Callable, Callable]]:
+    """Parses every saved deck and format page ahead of time, so only section detection is left to be run.
+    :param corpus: dictionary of page type to the HTML texts of its pages
+    :return: list of page type, parsed pages, and the single pass and legacy section detection to run on them
+    """
+    decks = [prs.get_entry_deck_info(prs.make_soup(page, REFERENCE_BACKEND))[0] for page in corpus['deck']]
+    event_pages = [get_event_rows(prs.make_soup(page, REFERENCE_BACKEND)) for page in corpus['format']]
+    return [('deck', decks, prs.get_cards_info, legacy_get_cards_info),
+            ('format', event_pages, get_normal_events, legacy_get_normal_events)]
+
+
+def check_sections(page_type: str, inputs: List[Any], current: Callable, legacy: Callable) -> bool:
+    """Checks single pass section detection returns the same results as the legacy per row detection on every page.
+    :param page_type: one of PAGE_TYPES
+    :param inputs: parsed pages to run on
+    :param current: single pass section detection
+    :param legacy: legacy per row section detection
+    :return: if both agree on every page
+    """
+    mismatches = [idx for idx, page_input in enumerate(inputs) if current(page_input) != legacy(page_input)]
+    if mismatches:
+        print(f'{page_type}: results differ from legacy section detection on pages {mismatches}')
+    return not mismatches
+
+
+def benchmark_sections(corpus: Dict[str, List[str]], repeats: int) -> None:
+    """Checks single pass section detection returns the same results as the legacy per row detection on every saved
+    deck and format page, then times both over pages parsed ahead of time so only section detection is measured.
+    :param corpus: dictionary of page type to the HTML texts of its pages
+    :param repeats: number of times to run over every page when timing
+    :return: None
+    """
+    for page_type, inputs, current, legacy in get_section_comparisons(corpus):
+        if not inputs or not check_sections(page_type, inputs, current, legacy):
+            continue
+
+        rows_per_page = sum(len(page_input) for page_input in inputs) / len(inputs)
+        print(f'{page_type}: {len(inputs)} pages, {rows_per_page:.0f} rows per page')
+        for name, func in (('current', current), ('legacy', legacy)):
+            print(f'  {name}: {time_per_page(func, inputs, repeats):.3f} ms per page')
+
+
+def main() -> None:
+    parser = ap.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    backends_parser = subparsers.add_parser('backends', help='compare parser backends')
+    backends_parser.add_argument('-b', nargs='+', default=None, choices=prs.PARSER_BACKENDS,
+                                 help='parser backends to run, every installed backend if not given')
+    sections_parser = subparsers.add_parser('sections', help='compare single pass and legacy section detection')
+    check_parser = subparsers.add_parser('check', help='check single pass and legacy section detection agree')
+
+    for sub_parser in (backends_parser, sections_parser, check_parser):
+        sub_parser.add_argument('corpus', nargs='?', default=str(FIXTURES_DIRC),
+                                help="directory holding 'format', 'event', and 'deck' subdirectories of saved pages")
+        sub_parser.add_argument('-r', default=3, type=int, help='times to parse every page when timing')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if args.benchmark == 'check':
+        comparisons = get_section_comparisons(corpus)
+        if not all([check_sections(*comparison) for comparison in comparisons]):
+            sys.exit(1)
+        print(', '.join(f'{len(inputs)} {page_type} pages' for page_type, inputs, _, _ in comparisons) + ' agree')
+        return
+    elif args.benchmark == 'sections':
+        benchmark_sections(corpus, args.r)
+        return
+
+    backends = get_available_backends() if args.b is None else args.b
+    for page_type in PAGE_TYPES:
+        if corpus[page_type]:
+            benchmark_page_type(page_type, corpus[page_type], backends, args.r)
+
+
+if __name__ == '__main__':
+    main()
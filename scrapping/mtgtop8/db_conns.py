@@ -1,53 +1,55 @@
 from psycopg2 import sql
-
-import scrapping.utility as su
+from psycopg2.extras import execute_values
 
 """Module for inserting tournament data from mtgtop8.com."""
 
 
-def insert_into_tournament_info(event_name, event_date, event_format, event_url, db_cursor, logger, prod_mode):
-    """Inserts info for a tournament into the cursor of the given database. Assume size is None for now, can be lated
-    updated if needed
+def upsert_tournament_info(event_name, event_date, event_format, event_url, db_cursor, logger):
+    """Inserts info for a tournament into the cursor of the given database, returning the tournament's unique ID whether
+    it was just inserted or already present, in a single round trip. Assume size is None for now, can be later updated if
+    needed
     :param event_name: name of tournament
     :param event_date: date tournament was held
     :param event_format: format tournament was played in
     :param event_url: url from which tournament info was pulled from
     :param db_cursor: cursor of the database where info will be pushed
     :param logger: logger by which info will be logged
-    :return: None
-    """
-
-    def insert_query_func():
-        insert_query = sql.SQL('INSERT INTO {} ({}, {}, {}, {}) VALUES (%s, %s, %s, %s)').format(
-            sql.Identifier('events', 'event_info'),
-            sql.Identifier('name'),
-            sql.Identifier('date'),
-            sql.Identifier('format'),
-            sql.Identifier('url'))
-        db_cursor.execute(insert_query, (event_name, event_date, event_format, event_url))
-
-    warning_msg = f'Duplicate entry for tournament_info attempted, key {event_name}, {event_date}'
-    su.execute_query(insert_query_func, logger, warning_msg, prod_mode)
-
-
-def get_tournament_info_id(event_name, event_date, event_format, event_url, db_cursor):
-    """
-    :param event_name:
-    :param event_date:
-    :param event_format:
-    :param event_url:
-    :param db_cursor:
-    :return:
+    :return: unique ID of the tournament
     """
-    tourny_id_query = sql.SQL('SELECT {} FROM {} WHERE {} = %s AND {} = %s AND {} = %s AND {} = %s').format(
-        sql.Identifier('tourny_id'),
+    # no-op update on conflict so the existing row is still returned
+    upsert_query = sql.SQL('INSERT INTO {} ({}, {}, {}, {}) VALUES (%s, %s, %s, %s) ON CONFLICT ({}, {}, {}, {}) '
+                           'DO UPDATE SET {} = EXCLUDED.{} RETURNING {}, (xmax = 0)').format(
         sql.Identifier('events', 'event_info'),
         sql.Identifier('name'),
         sql.Identifier('date'),
         sql.Identifier('format'),
-        sql.Identifier('url'))
-    db_cursor.execute(tourny_id_query, (event_name, event_date, event_format, event_url))
-    return int(db_cursor.fetchone()[0])
+        sql.Identifier('url'),
+        sql.Identifier('name'),
+        sql.Identifier('date'),
+        sql.Identifier('format'),
+        sql.Identifier('url'),
+        sql.Identifier('name'),
+        sql.Identifier('name'),
+        sql.Identifier('tourny_id'))
+    db_cursor.execute(upsert_query, (event_name, event_date, event_format, event_url))
+    tourny_id, inserted = db_cursor.fetchone()
+    if not inserted:
+        logger.warning(f'Duplicate entry for tournament_info attempted, key {event_name}, {event_date}')
+    return int(tourny_id)
+
+
+def get_known_event_urls(event_format, db_cursor):
+    """Retrieves the url of every tournament of the given format already in the database of the given cursor.
+    :param event_format: format of the tournaments
+    :param db_cursor: cursor of the database where tournament info resides
+    :return: set of tournament urls
+    """
+    url_query = sql.SQL('SELECT {} FROM {} WHERE {} = %s').format(
+        sql.Identifier('url'),
+        sql.Identifier('events', 'event_info'),
+        sql.Identifier('format'))
+    db_cursor.execute(url_query, (event_format,))
+    return {url for url, in db_cursor.fetchall()}
 
 
 def update_tournament_info_size(tourny_id, size, db_cursor, logger):
@@ -66,74 +68,122 @@ def update_tournament_info_size(tourny_id, size, db_cursor, logger):
     logger.info(f'Updating size for tournament {tourny_id} to size {size}')
 
 
-def insert_into_tournament_entry(tourny_id, deck_archetype, deck_placement, player_name, deck_name,
-                                 placement_url, db_cursor, logger, prod_mode):
-    """
-    :param tourny_id:
-    :param deck_archetype:
-    :param deck_placement:
-    :param player_name:
-    :param deck_name:
-    :param placement_url:
-    :param db_cursor:
-    :param logger:
-    :return:
-    """
-    def insert_query_func():
-        insert_query = sql.SQL('INSERT INTO {} ({}, {}, {}, {}, {}, {}) VALUES (%s, %s, %s, %s, %s, %s)').format(
-            sql.Identifier('events', 'event_entry'),
-            sql.Identifier('tourny_id'),
-            sql.Identifier('archetype'),
-            sql.Identifier('place'),
-            sql.Identifier('player'),
-            sql.Identifier('deck_name'),
-            sql.Identifier('url'))
-        db_cursor.execute(insert_query, (tourny_id, deck_archetype, deck_placement, player_name, deck_name,
-                                         placement_url))
-
-    warning_msg = f'Duplicate entry for tournament_entry attempted, for key {tourny_id}, {deck_archetype}, ' \
-                  f'{deck_placement}, {player_name}'
-    su.execute_query(insert_query_func, logger, warning_msg, prod_mode)
-
-
-def get_tournament_entry_id(tourny_id, deck_archetype, deck_placement, player_name, db_cursor):
-    """
-    :param tourny_id:
-    :param deck_archetype:
-    :param deck_placement:
-    :param player_name:
-    :param db_cursor:
-    :return:
+def upsert_tournament_entry(tourny_id, deck_archetype, deck_placement, player_name, deck_name, placement_url,
+                            db_cursor, logger):
+    """Inserts info for a deck placed in a tournament into the cursor of the given database, returning the entry's
+    unique ID whether it was just inserted or already present, in a single round trip.
+    :param tourny_id: id of the tournament the deck was entered in
+    :param deck_archetype: archetype of the deck
+    :param deck_placement: rank of the deck in the tournament
+    :param player_name: name of deck's pilot
+    :param deck_name: name of the deck
+    :param placement_url: url containing ranked deck info
+    :param db_cursor: cursor of the database where info will be pushed
+    :param logger: logger by which info will be logged
+    :return: unique ID of the entry
     """
-    entry_id_query = sql.SQL('SELECT {} FROM {} WHERE {} = %s AND {} = %s AND {} = %s AND {} = %s').format(
-        sql.Identifier('entry_id'),
+    # no-op update on conflict so the existing row is still returned
+    upsert_query = sql.SQL('INSERT INTO {} ({}, {}, {}, {}, {}, {}) VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT '
+                           '({}, {}, {}, {}) DO UPDATE SET {} = EXCLUDED.{} RETURNING {}, (xmax = 0)').format(
         sql.Identifier('events', 'event_entry'),
         sql.Identifier('tourny_id'),
         sql.Identifier('archetype'),
         sql.Identifier('place'),
-        sql.Identifier('player'))
-    db_cursor.execute(entry_id_query, (tourny_id, deck_archetype, deck_placement, player_name))
-    return int(db_cursor.fetchone()[0])
-
+        sql.Identifier('player'),
+        sql.Identifier('deck_name'),
+        sql.Identifier('url'),
+        sql.Identifier('tourny_id'),
+        sql.Identifier('archetype'),
+        sql.Identifier('place'),
+        sql.Identifier('player'),
+        sql.Identifier('player'),
+        sql.Identifier('player'),
+        sql.Identifier('entry_id'))
+    db_cursor.execute(upsert_query, (tourny_id, deck_archetype, deck_placement, player_name, deck_name,
+                                     placement_url))
+    entry_id, inserted = db_cursor.fetchone()
+    if not inserted:
+        logger.warning(f'Duplicate entry for tournament_entry attempted, for key {tourny_id}, {deck_archetype}, '
+                       f'{deck_placement}, {player_name}')
+    return int(entry_id)
+
+
+def insert_entry_cards(entry_id, card_rows, db_cursor, logger):
+    """Inserts every card of a deck into the cursor of the given database in a single statement, skipping any card
+    already present.
+    :param entry_id: id of the entry the cards were played in
+    :param card_rows: list of card name, if in mainboard, and quantity of each card in the deck
+    :param db_cursor: cursor of the database where info will be pushed
+    :param logger: logger by which info will be logged
+    :return: None
+    """
+    if not card_rows:
+        return
 
-def insert_into_entry_card(entry_id, card_name, in_mainboard, quantity, db_cursor, logger, prod_mode):
+    insert_query = sql.SQL('INSERT INTO {} ({}, {}, {}, {}) VALUES %s ON CONFLICT DO NOTHING').format(
+        sql.Identifier('events', 'entry_card'),
+        sql.Identifier('entry_id'),
+        sql.Identifier('card'),
+        sql.Identifier('mainboard'),
+        sql.Identifier('quantity'))
+    rows = [(entry_id, card_name, in_mainboard, quantity) for card_name, in_mainboard, quantity in card_rows]
+    execute_values(db_cursor, insert_query, rows, page_size=len(rows))  # one page so rowcount covers every row
+
+    duplicates = len(rows) - db_cursor.rowcount
+    if duplicates:
+        logger.warning(f'{duplicates} duplicate entries for entry_card attempted for entry {entry_id}')
+
+
+def get_crawl_progress(event_format, db_cursor):
+    """Retrieves the checkpointed progress of the crawl of the given format, as committed by a previous run.
+    :param event_format: format being crawled
+    :param db_cursor: cursor of the database where crawl progress resides
+    :return: dictionary of page number to the number of events done on the page and if the page was completed
     """
-    :param entry_id:
-    :param card_name:
-    :param in_mainboard:
-    :param quantity:
-    :param db_cursor:
-    :param logger:
-    :return:
+    progress_query = sql.SQL('SELECT {}, {}, {} IS NOT NULL FROM {} WHERE {} = %s').format(
+        sql.Identifier('page'),
+        sql.Identifier('events_done'),
+        sql.Identifier('completed_at'),
+        sql.Identifier('events', 'crawl_progress'),
+        sql.Identifier('format'))
+    db_cursor.execute(progress_query, (event_format,))
+    return {page: (events_done, completed) for page, events_done, completed in db_cursor.fetchall()}
+
+
+def save_crawl_progress(event_format, page, events_done, completed, db_cursor):
+    """Checkpoints the progress of the crawl of the given format on the given page. Meant to be committed in the same
+    transaction as the data it records, so the checkpoint never runs ahead of what was stored.
+    :param event_format: format being crawled
+    :param page: page of the format's events
+    :param events_done: number of events on the page done
+    :param completed: if every event on the page is done
+    :param db_cursor: cursor of the database where crawl progress resides
+    :return: None
+    """
+    upsert_query = sql.SQL('INSERT INTO {} ({}, {}, {}, {}) VALUES (%s, %s, %s, CASE WHEN %s THEN now() END) '
+                           'ON CONFLICT ({}, {}) DO UPDATE SET {} = EXCLUDED.{}, {} = EXCLUDED.{}').format(
+        sql.Identifier('events', 'crawl_progress'),
+        sql.Identifier('format'),
+        sql.Identifier('page'),
+        sql.Identifier('events_done'),
+        sql.Identifier('completed_at'),
+        sql.Identifier('format'),
+        sql.Identifier('page'),
+        sql.Identifier('events_done'),
+        sql.Identifier('events_done'),
+        sql.Identifier('completed_at'),
+        sql.Identifier('completed_at'))
+    db_cursor.execute(upsert_query, (event_format, page, events_done, completed))
+
+
+def finish_crawl(event_format, db_cursor):
+    """Removes the per page checkpoints of the crawl of the given format once it has finished, so the next run crawls
+    the format from the first page, while formats that didn't finish still resume from their partly done pages.
+    :param event_format: format that was crawled
+    :param db_cursor: cursor of the database where crawl progress resides
+    :return: None
     """
-    def insert_query_func():
-        insert_query = sql.SQL('INSERT INTO {} ({}, {}, {}, {}) VALUES (%s, %s, %s, %s)').format(
-            sql.Identifier('events', 'entry_card'),
-            sql.Identifier('entry_id'),
-            sql.Identifier('card'),
-            sql.Identifier('mainboard'),
-            sql.Identifier('quantity'))
-        db_cursor.execute(insert_query, (entry_id, card_name, in_mainboard, quantity))
-
-    warning_msg = f'Duplicate entry for entry_card attempted: key {entry_id}, {card_name}, {in_mainboard}, {quantity}'
-    su.execute_query(insert_query_func, logger, warning_msg, prod_mode)
+    delete_query = sql.SQL('DELETE FROM {} WHERE {} = %s').format(
+        sql.Identifier('events', 'crawl_progress'),
+        sql.Identifier('format'))
+    db_cursor.execute(delete_query, (event_format,))
@@ -1,52 +1,77 @@
+import argparse as ap
+import concurrent.futures as cf
+import datetime as dt
 import multiprocessing as mp
-import random
 import re
-import time
+from contextlib import closing
 
-import bs4
 import psycopg2.errors
-import requests
 
 import database.db_reader as dbr
+import scrapping.http_cache as hc
 import scrapping.mtgtop8.db_conns as dbc
 import scrapping.mtgtop8.parsing as prs
-from scrapping.utility import init_logging
+from scrapping.utility import init_logging, RateLimiter
 
 WORKER_COUNT = 4
+REQUESTS_PER_SECOND = 2  # combined across all workers
+ENTRY_FETCH_WORKERS = 8  # max deck pages of one event in flight at once, per worker
+RATE_LIMITER = RateLimiter(REQUESTS_PER_SECOND)
+INCREMENTAL_LOOKBACK = 1  # pages
+MAX_PAGE = 2 ** 31 - 1
+LISTING_TTL = dt.timedelta(hours=12)  # format listing pages gain new events, event and deck pages never change
 
 """Module for pulling tournament data from mtgtop8.com."""
 
 
-def get_and_wait(url, data=None):
-    """Retrieves the data from the given url and returns a BeautifulSoup parser on the HTML the url response returns. Puts
-    the thread to sleep for a random amount of seconds after retrieval to ensure that server being requested from isn't
-    overwhelmed and that scrapping appears less conspicuous.
+def get_and_wait(url, data=None, parse_only=None):
+    """Retrieves the data from the given url and returns a BeautifulSoup parser on the HTML the url response returns. Goes
+    through the HTTP cache, and waits on the rate limiter shared by every worker before sending any request not answered
+    from the cache, to ensure that server being requested from isn't overwhelmed no matter how many workers are running.
     :param url: url to fetch data from
     :param data: any additional data to send with url_data, treats as a post request if included
+    :param parse_only: SoupStrainer selecting the parts of the page to parse, whole page is parsed if not given
     :return: HTML BeautifulSoup parser on the HTML text the request on url_data returns
     """
-    url_data = requests.post(url=url, data=data) if data else requests.get(url=url)
-    time.sleep(random.random() * 2)
-    return bs4.BeautifulSoup(markup=url_data.text, features='html.parser')
+    url_data = hc.post(url, data, LISTING_TTL, RATE_LIMITER) if data else hc.get(url, None, RATE_LIMITER)
+    return prs.make_soup(url_data.text, parse_only=parse_only)
 
 
-def retrieve_and_parse(search_url, url_format, database, prod_mode, user=dbr.USER):
+def retrieve_and_parse(search_url, url_format, database, prod_mode, user=dbr.USER, incremental=False,
+                       lookback=INCREMENTAL_LOOKBACK):
     """Given a search to a format's webpage on mtgtop8.com, pulls all tournaments and their related placement info and
     loads them into the given Postgres database. Pulls all tournament info, placements in each tournament, cards played
-    in each entry, etc.
+    in each entry, etc. In incremental mode tournaments already in the database are skipped without fetching their
+    pages, and paging stops 'lookback' pages after the first page made up only of tournaments already in the database.
+    Progress through each page is checkpointed in the same transaction as each tournament, so a crawl that dies part way
+    through resumes where it left off on the next run, skipping completed pages and tournaments already stored on partly
+    done pages. Checkpoints are removed once the crawl finishes.
     :param search_url: main url page to parse
     :param url_format: format being queried
     :param database: name of Postgres database
     :param user: login user for given database
-    :return: None
+    :param incremental: if only tournaments not already in the database should be pulled
+    :param lookback: number of pages to keep paging past the first fully ingested page, in incremental mode
+    :return: if the crawl of the format finished
     """
-    def process(page: int, page_leap: int, parsing: mp.Value):
+    with closing(psycopg2.connect(user=user, dbname=database)) as con:
+        with con.cursor() as cursor:
+            progress = dbc.get_crawl_progress(url_format, cursor)
+            known_urls = dbc.get_known_event_urls(url_format, cursor) if incremental or progress else set()
+    skip_urls = known_urls if incremental else set()
+
+    def process(page: int, page_leap: int, last_page: mp.Value, failed: mp.Value):
         logger = init_logging(f'mtgtop8_scrapper_{page}.log')
         try:
             with psycopg2.connect(user=user, dbname=database) as con:
-                con.autocommit = True
                 with con.cursor() as cursor:
-                    while parsing.value > 0:
+                    while page <= last_page.value:
+                        events_done, completed = progress.get(page, (0, False))
+                        if completed:
+                            logger.info(f'Skipping page {page} in format {url_format}, completed on a previous run')
+                            page += page_leap
+                            continue
+
                         base_url = re.match('.*.com/', search_url).group()
                         logger.info(f'Fetching for page {page} in format {url_format} from url {search_url}')
                         child_page_value = {'cp': page}  # set page value
@@ -54,25 +79,44 @@ def retrieve_and_parse(search_url, url_format, database, prod_mode, user=dbr.USE
                         events = prs.get_events_from_page(url_soup, base_url, logger)
 
                         if events:
-                            for event_name, event_date, event_url in events:
-                                dbc.insert_into_tournament_info(event_name, event_date, url_format, event_url, cursor,
-                                                                logger, prod_mode)
-                                tourny_id = dbc.get_tournament_info_id(event_name, event_date, url_format, event_url,
-                                                                       cursor)
+                            # tournaments stored before a restart are skipped, the page may have shifted since
+                            stored_urls = known_urls if page in progress else skip_urls
+                            new_events = [event for event in events if event[2] not in skip_urls]
+                            for idx, (event_name, event_date, event_url) in enumerate(events):
+                                if event_url in stored_urls:
+                                    continue
+                                tourny_id = dbc.upsert_tournament_info(event_name, event_date, url_format, event_url,
+                                                                       cursor, logger)
                                 parse_event(tourny_id, event_url, base_url, cursor, logger, prod_mode)
+                                dbc.save_crawl_progress(url_format, page, max(events_done, idx + 1), False, cursor)
+                                con.commit()
+
+                            dbc.save_crawl_progress(url_format, page, len(events), True, cursor)
+                            con.commit()
+
+                            # pages are ordered newest first, so every later page should be fully ingested too
+                            if incremental and not new_events:
+                                logger.info(f'Page {page} in format {url_format} already ingested')
+                                with last_page.get_lock():
+                                    last_page.value = min(last_page.value, page + lookback)
 
                             page += page_leap
-                        else:
-                            with parsing.get_lock():
-                                parsing.value = 0
+                        else:  # empty page, final page has been passed but lower pages may still be in progress
+                            with last_page.get_lock():
+                                last_page.value = min(last_page.value, page - 1)
         except Exception as e:
+            with failed.get_lock():
+                failed.value = 1
             if prod_mode:
                 logger.warning(str(e))
             else:
                 raise e
 
-    keep_parsing = mp.Value('i', 1)
-    processes = [mp.Process(target=process, args=(idx, WORKER_COUNT, keep_parsing,)) for idx in range(WORKER_COUNT)]
+    last_page = mp.Value('i', MAX_PAGE)  # lowered on reaching an empty page, or an ingested page in incremental mode
+    any_failed = mp.Value('i', 0)
+    worker_count = hc.worker_count(WORKER_COUNT)
+    processes = [mp.Process(target=process, args=(idx, worker_count, last_page, any_failed,))
+                 for idx in range(worker_count)]
 
     for process in processes:
         process.start()
@@ -80,11 +124,20 @@ def retrieve_and_parse(search_url, url_format, database, prod_mode, user=dbr.USE
     for process in processes:
         process.join()
 
+    # only forget page checkpoints once every worker got to the end without error, else the next run resumes from them
+    finished = any_failed.value == 0 and all(process.exitcode == 0 for process in processes)
+    if finished:
+        with closing(psycopg2.connect(user=user, dbname=database)) as con:
+            with con:
+                with con.cursor() as cursor:
+                    dbc.finish_crawl(url_format, cursor)
+    return finished
+
 
 def parse_event(tourny_id, event_url, base_url, db_cursor, logger, prod_mode):
     """Given the url_data of a tournament on mtgtop8.com, pulls all decks that placed in the tournament and enters them into
     into the database of the given database cursor. Pulls player of each placement, the info of the deck they played,
-    etc.
+    etc. The pages of every placed deck are fetched concurrently, then parsed and stored once all have arrived.
     :param tourny_id: if of event to parse
     :param event_url: url of the event to parse
     :param base_url: base url to combine with parsed deck entry urls
@@ -93,24 +146,34 @@ def parse_event(tourny_id, event_url, base_url, db_cursor, logger, prod_mode):
     :param prod_mode:
     :return: None
     """
-    url_data = get_and_wait(event_url)
+    url_data = get_and_wait(event_url, parse_only=prs.EVENT_PAGE_STRAINER)
     deck_parents, event_size = prs.get_event_info(url_data)
 
     if event_size:
         dbc.update_tournament_info_size(tourny_id, event_size, db_cursor, logger)
 
+    entries = []
     for parent in deck_parents:
         entry_url_ending, deck_name, deck_rank, player_name = prs.get_event_entry_info(parent)
         entry_url = base_url + entry_url_ending
         logger.info('Fetching tournament entry {} from {}'.format(deck_name, entry_url))
-        parse_entry(tourny_id, entry_url, deck_name, deck_rank, player_name, db_cursor, logger, prod_mode)
+        entries.append((entry_url, deck_name, deck_rank, player_name))
+
+    # requests still go through the shared rate limiter, threads only overlap the time spent waiting on responses
+    with cf.ThreadPoolExecutor(max_workers=ENTRY_FETCH_WORKERS) as pool:
+        entry_soups = list(pool.map(lambda entry: get_and_wait(entry[0]), entries))
+
+    for (entry_url, deck_name, deck_rank, player_name), url_soup in zip(entries, entry_soups):
+        parse_entry(tourny_id, entry_url, url_soup, deck_name, deck_rank, player_name, db_cursor, logger, prod_mode)
 
 
-def parse_entry(tourny_id, placement_url, deck_name, deck_placement, player_name, db_cursor, logger, prod_mode):
-    """Given the url to a deck placement for a tournament on mtgtop8.com, pull the ranked deck's info in the database of
+def parse_entry(tourny_id, placement_url, url_soup, deck_name, deck_placement, player_name, db_cursor, logger,
+                prod_mode):
+    """Given the page of a deck placement for a tournament on mtgtop8.com, pull the ranked deck's info in the database of
     the given database cursor. Info such as played cards, card quantities, player name, ranking, etc.
     :param tourny_id: id of the tournament the deck was entered in
     :param placement_url: url containing ranked deck info
+    :param url_soup: HTML BeautifulSoup parser on the page at placement_url
     :param deck_name: name of the deck
     :param deck_placement: rank of the deck in the associated tournament
     :param player_name: name of deck's pilot
@@ -119,38 +182,49 @@ def parse_entry(tourny_id, placement_url, deck_name, deck_placement, player_name
     :param prod_mode:
     :return: None
     """
-    url_soup = get_and_wait(placement_url)
-
     # deck archetype can only be retrieved from deck url
     cards, deck_archetype = prs.get_entry_deck_info(url_soup)
+    if not cards:  # error page, or in replay mode a page missing from the HTTP cache
+        logger.warning(f'Skipping tournament entry {deck_name} from {placement_url}, no deck found on its page')
+        return
 
     if deck_archetype is None:
         deck_archetype = 'unknown' if deck_name is None else deck_name
 
     deck_archetype = deck_archetype.lower()
 
-    # insert deck specific info (ie not card info)
-    dbc.insert_into_tournament_entry(tourny_id, deck_archetype, deck_placement, player_name, deck_name, placement_url,
-                                     db_cursor, logger, prod_mode)
-
-    # get unique id for entered deck, to use for entering
-    entry_id = dbc.get_tournament_entry_id(tourny_id, deck_archetype, deck_placement, player_name, db_cursor)
+    # insert deck specific info (ie not card info), getting back unique id for entered deck
+    entry_id = dbc.upsert_tournament_entry(tourny_id, deck_archetype, deck_placement, player_name, deck_name,
+                                           placement_url, db_cursor, logger)
 
-    # insert every card in deck
-    for card in cards:
-        card_name, in_mainboard, quantity = prs.get_card_info(card)
-        logger.info(f'Fetching card {card_name} from {entry_id}')
-        dbc.insert_into_entry_card(entry_id, card_name, in_mainboard, quantity, db_cursor, logger, prod_mode)
+    # insert every card in deck at once
+    card_rows = prs.get_cards_info(cards)
+    logger.info(f'Inserting {len(card_rows)} cards from {entry_id}')
+    dbc.insert_entry_cards(entry_id, card_rows, db_cursor, logger)
 
 
-def main(prod_mode):
+def main(prod_mode, parser_backend=prs.PARSER_BACKEND, incremental=False, lookback=INCREMENTAL_LOOKBACK):
+    prs.PARSER_BACKEND = parser_backend  # set before workers are forked so every worker inherits it
     urls_and_formats = [('https://www.mtgtop8.com/format?f=MO&meta=44', 'modern'),
                         ('https://www.mtgtop8.com/format?f=LE&meta=16', 'legacy'),
                         ('https://www.mtgtop8.com/format?f=ST&meta=58', 'standard'),
                         ('https://www.mtgtop8.com/format?f=PI&meta=191', 'pioneer')]
+    logger = init_logging('mtgtop8_scrapper.log')  # workers replace its handlers with their own after forking
+
+    # each format is its own resumable crawl, a format that fails doesn't hold back the others
     for url, url_format in urls_and_formats:
-        retrieve_and_parse(url, url_format, dbr.DATABASE_NAME, prod_mode)
+        finished = retrieve_and_parse(url, url_format, dbr.DATABASE_NAME, prod_mode, incremental=incremental,
+                                      lookback=lookback)
+        logger.info(f'Crawl of format {url_format} ' + ('finished' if finished else 'will resume on the next run'))
+    RATE_LIMITER.report(logger, 'mtgtop8.com')
 
 
 if __name__ == '__main__':
-    main(True)
+    parser = ap.ArgumentParser()
+    parser.add_argument('-i', action='store_true', help='skip and stop paging at events already stored')
+    parser.add_argument('-l', default=INCREMENTAL_LOOKBACK, type=int,
+                        help='pages to keep paging past the first fully stored page with -i')
+    parser.add_argument('-b', default=prs.PARSER_BACKEND, choices=prs.PARSER_BACKENDS,
+                        help='HTML parser backend, html5lib must be installed separately')
+    args = parser.parse_args()
+    main(True, parser_backend=args.b, incremental=args.i, lookback=args.l)
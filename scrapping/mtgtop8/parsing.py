@@ -1,8 +1,31 @@
 import datetime
 import re
 
+import bs4
+
 """Module for parsing tournament data from mtgtop8.com  """
 
+# parser constants, html.parser is always available, lxml is a requirement, and html5lib must be installed separately
+PARSER_BACKENDS = ('html.parser', 'lxml', 'html5lib')
+PARSER_BACKEND = 'html.parser'
+EVENT_PARENT_CLASSES = ['chosen_tr', 'hover_tr']
+
+
+def has_event_page_class(value):
+    """Checks if a class attribute holds a class read by get_event_info or get_event_entry_info. Depending on the
+    BeautifulSoup version a strainer is given either the raw attribute string or its individual classes.
+    :param value: class attribute value, or a single class
+    :return: if any of the classes is kept when straining an event page
+    """
+    if value is None:
+        return False
+    classes = value.split() if isinstance(value, str) else value
+    return any(class_name in EVENT_PARENT_CLASSES or class_name == 'S14' for class_name in classes)
+
+
+# only keeps the parts of an event page read by get_event_info and get_event_entry_info
+EVENT_PAGE_STRAINER = bs4.SoupStrainer(class_=has_event_page_class)
+
 # regex constants
 EVENT_URL_REGEX = re.compile('event\?e=[0-9]+&f=[A-Z]+')
 EVENT_SIZE_REGEX = re.compile('[0-9]+ players')
@@ -14,6 +37,19 @@ DECK_ARCHETYPE_IMG_REGEX = re.compile('graph/manas/[a-zA-Z]+.png')
 MALFORMED_EVENT_URLS = ['https://www.mtgtop8.com/event?e=7018&f=LE']
 
 
+def make_soup(markup, backend=None, parse_only=None):
+    """Parses the given HTML with the given parser backend, keeping only the parts matched by the given strainer if any.
+    :param markup: HTML text to parse
+    :param backend: one of PARSER_BACKENDS, PARSER_BACKEND if not given
+    :param parse_only: SoupStrainer selecting the parts of the page to keep, whole page is kept if not given
+    :return: BeautifulSoup parser on the given HTML
+    """
+    backend = PARSER_BACKEND if backend is None else backend
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(f'{backend} is an unsupported parser backend')
+    return bs4.BeautifulSoup(markup=markup, features=backend, parse_only=parse_only)
+
+
 def format_date(date):
     """
     Formats a 'dd/mm/yyyy' date into a 'mm/dd/yyyy'.
@@ -40,19 +76,46 @@ def get_entry_rank(parent_elements):
     return rank.get_text()
 
 
-def card_in_mainboard(card):
+def tag_sections(rows, starts_section):
+    """Checks for each of the given rows if any sibling before it starts a new section of the page, walking the
+    siblings of the rows once in document order rather than walking back from every row.
+    :param rows: elements to tag, in any order
+    :param starts_section: function returning if a sibling element starts the section
+    :return: list of if each row comes after the start of the section, in the same order as the given rows
     """
+    rows_by_parent = {}
+    for row in rows:
+        rows_by_parent.setdefault(id(row.parent), (row.parent, set()))[1].add(id(row))
+
+    in_section = {}
+    for parent, row_ids in rows_by_parent.values():
+        after_start = False
+        for sibling in parent.children:
+            if id(sibling) in row_ids:
+                in_section[id(sibling)] = after_start
+            if not after_start and starts_section(sibling):  # once started the section lasts to the last sibling
+                after_start = True
+    return [in_section[id(row)] for row in rows]
+
+
+def starts_sideboard(sibling):
+    """
+    :param sibling: sibling of the element holding a card
+    :return: if the sibling holds the sideboard header of a deck
+    """
+    if not isinstance(sibling, bs4.Tag):
+        return False
+    header = sibling.find(class_='O13')
+    return header is not None and 'sideboard' in header.get_text().lower()
 
-    :param card:
-    :return:
+
+def starts_major_events(sibling):
+    """
+    :param sibling: sibling of an event row
+    :return: if the sibling holds the header of the last major events column
     """
-    for prev_sib in card.parent.previous_siblings:
-        has_class = prev_sib.find(class_='O13')
-        if has_class is not None:
-            title = has_class.get_text().lower()
-            if 'sideboard' in title:
-                return False
-    return True
+    text = str(sibling)
+    return 'class="w_title"' in text and 'Last major events' in text
 
 
 def get_events_from_page(url_soup, base_url, logger):
@@ -68,16 +131,8 @@ def get_events_from_page(url_soup, base_url, logger):
     events = [parent for parent in parents if parent.find(href=EVENT_URL_REGEX)]
 
     # parse out events in last major events column
-    normal_events = []
-    for parent in events:
-        if parent.previous_siblings is None:  # should never occur
-            normal_events.append(parent)
-        else:
-            major_event_header = any(['class="w_title"' in str(sibling)
-                                      and 'Last major events' in str(sibling)
-                                      for sibling in parent.previous_siblings])
-            if not major_event_header:
-                normal_events.append(parent)
+    is_major_event = tag_sections(events, starts_major_events)
+    normal_events = [event for event, is_major in zip(events, is_major_event) if not is_major]
 
     # empty pages == final page has been reached
     if len(normal_events) < 1:
@@ -101,7 +156,7 @@ def get_event_info(url_soup):
     :param url_soup:
     :return:
     """
-    possible_parents = url_soup.find_all(class_=lambda tag: tag in ('chosen_tr', 'hover_tr'))
+    possible_parents = url_soup.find_all(class_=EVENT_PARENT_CLASSES)
     deck_parents = [parent for parent in possible_parents if parent.find(href=DECK_URL_REGEX)]
     size = get_event_size(url_soup)
     return deck_parents, size
@@ -123,6 +178,8 @@ def get_event_entry_info(entry_soup):
 
 def get_deck_archetype_as_imgs(entry_soup):
     parent_class = entry_soup.find(class_='S16')
+    if parent_class is None:  # not a deck page, eg an error page or a page missing from the HTTP cache
+        return None
     imgs = parent_class.find_all(src=DECK_ARCHETYPE_IMG_REGEX)
     return ''.join(sorted([child['src'].split('.')[0][-1] for child in imgs]))
 
@@ -151,13 +208,23 @@ def get_entry_deck_info(entry_soup):
     return cards, deck_archetype
 
 
-def get_card_info(card_soup):
+def get_card_info(card_soup, in_mainboard):
     """
 
     :param card_soup:
+    :param in_mainboard: if the card is in the mainboard of its deck
     :return:
     """
     card_name = card_soup.find(class_='L14').get_text()
-    in_mainboard = str(card_in_mainboard(card_soup))  # check in sideboard
     quantity = int(card_soup.find(class_='hover_tr').get_text().split(' ')[0])  # TODO clean up
-    return card_name, in_mainboard, quantity
+    return card_name, str(in_mainboard), quantity
+
+
+def get_cards_info(cards):
+    """Gets the name, if in mainboard, and quantity of every card of a deck, finding which cards fall after the
+    sideboard header in a single pass over the deck.
+    :param cards: card elements of a deck, as returned by get_entry_deck_info
+    :return: list of card name, if in mainboard, and quantity of each card
+    """
+    in_sideboard = tag_sections([card.parent for card in cards], starts_sideboard)
+    return [get_card_info(card, not sideboard) for card, sideboard in zip(cards, in_sideboard)]
@@ -1,16 +1,22 @@
+import argparse as ap
+
+import database.migrate as m
+import scrapping.http_cache as hc
 import scrapping.mtggoldfish.pricing_data as p
 import scrapping.mtgtop8.event_data as e
+import scrapping.mtgtop8.parsing as prs
 import scrapping.scryfall.card_info as c
 import scrapping.scryfall.set_info as s
 
 """Module for running each scrapper in the correct order"""
 
 
-def main():
+def main(cache_mode=hc.MODE_ONLINE, cache_dirc=None, parser_backend=prs.PARSER_BACKEND):
     prod_mode = True
+    hc.configure(cache_mode, cache_dirc)  # before any scrapper forks its workers
 
     print('getting event data')
-    e.main(prod_mode)
+    e.main(prod_mode, parser_backend)
 
     print('getting set and card data')
     s.main(prod_mode)
@@ -19,6 +25,16 @@ def main():
     print('getting pricing data')
     p.main(prod_mode)
 
+    print('refreshing rollups')
+    m.refresh_rollups()
+
 
 if __name__ == '__main__':
-    main()
+    parser = ap.ArgumentParser()
+    parser.add_argument('-c', default=hc.MODE_ONLINE, choices=hc.MODES,
+                        help="HTTP cache mode, 'replay' rebuilds the database from cached responses only")
+    parser.add_argument('-d', default=None, help='HTTP cache directory')
+    parser.add_argument('-b', default=prs.PARSER_BACKEND, choices=prs.PARSER_BACKENDS,
+                        help='HTML parser backend for mtgtop8 pages, html5lib must be installed separately')
+    args = parser.parse_args()
+    main(args.c, args.d, args.b)
@@ -1,6 +1,10 @@
+import argparse as ap
+import urllib.parse as up
+from contextlib import closing
 from typing import Tuple, Set
 
 import psycopg2
+import requests
 from psycopg2 import sql
 
 import database.db_reader as dbr
@@ -11,8 +15,21 @@ from scrapping.scryfall import utility as ssu, set_info as si
 
 # Constants
 SCRYFALL_ENDPOINT = 'https://api.scryfall.com/cards/named'
+SCRYFALL_COLLECTION_ENDPOINT = 'https://api.scryfall.com/cards/collection'
+SCRYFALL_SEARCH_ENDPOINT = 'https://api.scryfall.com/cards/search?unique=prints&q={}'
+COLLECTION_SIZE = 75  # max identifiers per card collection request
+MAX_SEARCH_LENGTH = 1000  # max characters of a search query for printings
 INVALID_CARDS = ['Unknown Card']
 INVALID_TYPES = ['-', '//', 'ù']
+RARITIES = ('common', 'uncommon', 'rare', 'mythic')  # values of the cards.rarity enum
+CARD_TABLES = {  # table to columns of each table card data is stored in
+    ('cards', 'cmc'): ('card', 'cmc'),
+    ('cards', 'types'): ('card', 'type'),
+    ('cards', 'text'): ('card', 'text'),
+    ('cards', 'colors'): ('card', 'color'),
+    ('cards', 'pt'): ('card', 'power', 'toughness'),
+    ('cards', 'printings'): ('card', 'set', 'rarity')
+}
 
 
 def get_cards_in_db(db_cursor, logger):
@@ -29,6 +46,103 @@ def get_cards_in_db(db_cursor, logger):
     return [card for card in map(lambda x: x[0], db_cursor.fetchall()) if card not in INVALID_CARDS]
 
 
+def get_stored_cards(db_cursor):
+    """Retrieves the names of every card with both a cmc and one or more printings stored in the database of the given
+    cursor.
+    :param db_cursor: cursor of the database to draw data from
+    :return: set of card names
+    """
+    card_query = sql.SQL('SELECT {} FROM {} INTERSECT SELECT {} FROM {}').format(
+        sql.Identifier('card'),
+        sql.Identifier('cards', 'cmc'),
+        sql.Identifier('card'),
+        sql.Identifier('cards', 'printings'))
+    db_cursor.execute(card_query)
+    return {card for card, in db_cursor.fetchall()}
+
+
+def get_collection_data(card_names, logger):
+    """Retrieves the data of each given card from Scryfall's card collection endpoint, COLLECTION_SIZE cards per
+    request.
+    :param card_names: names of cards to retrieve data for
+    :param logger: logger to record any relevant information
+    :return: list of dictionaries of data for each card found, for a single printing of each card
+    """
+    cards = []
+    for idx in range(0, len(card_names), COLLECTION_SIZE):
+        names = card_names[idx:idx + COLLECTION_SIZE]
+        logger.info(f'Retrieving data for {len(names)} cards from the Scryfall collection endpoint')
+        response = ssu.json_from_post(SCRYFALL_COLLECTION_ENDPOINT, {'identifiers': [{'name': name} for name in names]})
+        cards.extend(response['data'])
+        for identifier in response.get('not_found', []):
+            logger.warning(f'Scryfall has no card named {identifier.get("name")}')
+    return cards
+
+
+def get_printings_queries(card_names):
+    """Groups the given cards into as few Scryfall searches for all their printings as possible, keeping each search
+    under MAX_SEARCH_LENGTH characters.
+    :param card_names: names of cards to search printings for
+    :return: list of search queries
+    """
+    queries, terms, length = [], [], 0
+    for name in card_names:
+        term = '!"{}"'.format(name.replace('"', ''))
+        if terms and length + len(term) + 4 > MAX_SEARCH_LENGTH:
+            queries.append(' or '.join(terms))
+            terms, length = [], 0
+        terms.append(term)
+        length += len(term) + 4
+    if terms:
+        queries.append(' or '.join(terms))
+    return queries
+
+
+def get_collection_printings(card_names, logger):
+    """Retrieves every printing of each given card, searching for the printings of many cards at once rather than
+    following each card's own prints search.
+    :param card_names: names of cards to retrieve printings for
+    :param logger: logger to record any relevant information
+    :return: list of dictionaries of data for each printing found
+    """
+    printings = []
+    for query in get_printings_queries(card_names):
+        search_url = SCRYFALL_SEARCH_ENDPOINT.format(up.quote(query))
+        try:
+            for page in ssu.iter_pages(search_url):
+                printings.extend(page['data'])
+        except requests.HTTPError as e:  # a search matching no cards is a 404
+            logger.warning(f'Failed to search printings with query {query}: {e}')
+    return printings
+
+
+def get_missing_card_data(database, user, logger, batch_size=ssu.WRITER_BATCH_SIZE,
+                          commit_size=ssu.WRITER_COMMIT_SIZE):
+    """Retrieves and stores the data of only the cards that have been played in a tournament in the database but are
+    missing a cmc or printings, through Scryfall's card collection endpoint and batched printing searches.
+    :param database: name of the database
+    :param user: username to login into the database with
+    :param logger: logger to record any relevant information
+    :param batch_size: number of rows buffered before writing
+    :param commit_size: number of rows written between commits
+    :return: None
+    """
+    with closing(psycopg2.connect(database=database, user=user)) as conn:
+        with conn.cursor() as cursor:
+            stored_cards = get_stored_cards(cursor)
+            missing_cards = [card for card in get_cards_in_db(cursor, logger) if card not in stored_cards]
+        logger.info(f'{len(missing_cards)} cards played in tournaments are missing card data')
+
+        with ssu.BatchWriter(conn, CARD_TABLES, logger, batch_size, commit_size) as writer:
+            for idx in range(0, len(missing_cards), COLLECTION_SIZE):
+                cards = get_collection_data(missing_cards[idx:idx + COLLECTION_SIZE], logger)
+                for card_data in cards:
+                    writer.add_all(get_card_rows(card_data))
+                for printing_data in get_collection_printings([card_data['name'] for card_data in cards], logger):
+                    writer.add_all(get_card_rows(printing_data, False))
+        writer.report()
+
+
 def get_card_data(card_name, logger):
     """Retrieves the data around a given card from the Scryfall API and returns it as a dictionary.
     :param card_name: (String) name of card to retrieve data for
@@ -39,34 +153,76 @@ def get_card_data(card_name, logger):
     return ssu.json_from_url(card_request_url)
 
 
-def parse_and_store(card_data, db_cursor, logger, prod_mode):
+def parse_and_store(card_data, writer):
     """Given a dictionary of data for a card, from attributes to attribute values - parses the dictionary such that all
-    needed info is extracted and inserted into the appropriate table in the database
-    :param card_data:
-    :param db_cursor:
-    :return:"""
+    needed info is extracted and buffered for the appropriate table in the given writer. Every printing of the card is
+    retrieved from its prints search
+    :param card_data: dictionary of data for a single printing of a card
+    :param writer: BatchWriter for the tables of CARD_TABLES
+    :return: None"""
+    rows = get_card_rows(card_data)
+    rows['cards', 'printings'] = [(card_data['name'], printing, rarity)
+                                  for printing, rarity in get_card_printings(card_data['prints_search_uri'])
+                                  if rarity in RARITIES]
+    writer.add_all(rows)
+
+
+def get_card_types(type_line):
+    return [card_type.lower() for card_type in type_line.split(' ') if card_type not in INVALID_TYPES + ['—']]
+
+
+def get_card_rows(card_data, include_attributes=True):
+    """Derives the rows of every card table from a single printing of a card, as found in a Scryfall bulk data file or
+    search page, applying the same rules as parse_and_store.
+    :param card_data: dictionary of data for a single printing of a card
+    :param include_attributes: if rows for attributes shared by every printing of the card (cmc, types, text, colors,
+    and power / toughness) should be derived, else only the printing's row is
+    :return: dictionary of each table in CARD_TABLES to its rows
+    """
     name = card_data['name']
-
-    def check_and_add(attribute, insert_func):
-        if attribute in card_data:
-            insert_func(name, card_data[attribute], db_cursor, logger, prod_mode)
-
-    check_and_add('cmc', insert_card_cmc)
-    check_and_add('type_line', insert_card_types)
-    check_and_add('oracle_text', insert_card_text)
-
-    if 'colors' not in card_data:
-        card_data['colors'] = ['c']
-    check_and_add('colors', insert_card_colors)
-
-    if 'power' in card_data and 'toughness' in card_data:
-        power = card_data['power']
-        toughness = card_data['toughness']
-        insert_card_pt(name, power, toughness, db_cursor, logger, prod_mode)
-
-    set_search_url = card_data['prints_search_uri']
-    card_printings = get_card_printings(set_search_url)
-    insert_card_printings(name, card_printings, db_cursor, logger, prod_mode)
+    rows = {table: [] for table in CARD_TABLES}
+
+    if include_attributes:
+        if 'cmc' in card_data:
+            rows['cards', 'cmc'].append((name, card_data['cmc']))
+        if 'type_line' in card_data:
+            rows['cards', 'types'].extend((name, card_type) for card_type in get_card_types(card_data['type_line']))
+        if 'oracle_text' in card_data:
+            rows['cards', 'text'].append((name, card_data['oracle_text']))
+        rows['cards', 'colors'].extend((name, color.lower()) for color in card_data.get('colors', ['c']))
+        if 'power' in card_data and 'toughness' in card_data:
+            rows['cards', 'pt'].append((name, card_data['power'], card_data['toughness']))
+
+    if card_data.get('rarity') in RARITIES:  # skip rarities such as 'special' the database doesn't support
+        rows['cards', 'printings'].append((name, card_data['set'], card_data['rarity']))
+    return rows
+
+
+def get_bulk_card_data(bulk_path, database, user, logger, batch_size=ssu.WRITER_BATCH_SIZE,
+                       commit_size=ssu.WRITER_COMMIT_SIZE):
+    """Stores the data of every card in a Scryfall bulk data file, such as the 'default cards' file, in a single pass
+    over the file without sending any requests. The file is streamed so it is never fully loaded into memory.
+    :param bulk_path: path of the bulk data file, optionally gzipped
+    :param database: name of the database
+    :param user: username to login into the database with
+    :param logger: logger to record any relevant information
+    :param batch_size: number of rows buffered before writing
+    :param commit_size: number of rows written between commits
+    :return: None
+    """
+    seen_names = set()  # attributes shared by every printing of a card are derived once per card
+    card_count = 0
+    with closing(psycopg2.connect(database=database, user=user)) as conn:
+        with ssu.BatchWriter(conn, CARD_TABLES, logger, batch_size, commit_size) as writer:
+            for card_data in ssu.iter_json_array(bulk_path):
+                if card_data['name'] in INVALID_CARDS:
+                    continue
+
+                writer.add_all(get_card_rows(card_data, card_data['name'] not in seen_names))
+                seen_names.add(card_data['name'])
+                card_count += 1
+        writer.report()
+    logger.info(f'Read {card_count} card printings of {len(seen_names)} cards from {bulk_path}')
 
 
 def get_card_printings(set_search_url: str) -> Set[Tuple[str, str]]:
@@ -74,119 +230,51 @@ def get_card_printings(set_search_url: str) -> Set[Tuple[str, str]]:
     the card was printed in - with its rarity at that printing.
     :param set_search_url: url to retrieve card set data from
     :return: list of sets the card associated with url has been printed in"""
-    json_response = ssu.json_from_url(set_search_url)
-    set_data = json_response['data']
-    return set([(card['set'], card['rarity']) for card in set_data])
-
-
-def insert_card_colors(card_name, colors, db_cursor, logger, prod_mode):
-    for color in colors:
-
-        def insert_query():
-            insert_query = ssu.get_n_item_insert_query(2).format(
-                sql.Identifier('cards', 'colors'),
-                sql.Identifier('card'),
-                sql.Identifier('color'))
-            db_cursor.execute(insert_query, (card_name, color.lower()))
-
-        logger.info(f'Inserting color {color} for card {card_name}')
-        warning_msg = f'Duplicate entry for card {card_name} with color {color}'
-        su.execute_query(insert_query, logger, warning_msg, prod_mode)
-
-
-def insert_card_pt(card_name, power, toughness, db_cursor, logger, prod_mode):
-    def insert_query():
-        insert_query = ssu.get_n_item_insert_query(3).format(
-            sql.Identifier('cards', 'pt'),
-            sql.Identifier('card'),
-            sql.Identifier('power'),
-            sql.Identifier('toughness'))
-        db_cursor.execute(insert_query, (card_name, power, toughness))
-
-    logger.info(msg=f'Inserting power {power}, toughness {toughness} info for card {card_name}')
-    warning_msg = f'Duplicate entry for for card {card_name} for power {power}, toughness {toughness}'
-    su.execute_query(insert_query, logger, warning_msg, prod_mode)
-
-
-def insert_card_text(card_name, text, db_cursor, logger, prod_mode):
-    def insert_query():
-        insert_query = ssu.get_n_item_insert_query(2).format(
-            sql.Identifier('cards', 'text'),
-            sql.Identifier('card'),
-            sql.Identifier('text'))
-        db_cursor.execute(insert_query, (card_name, text))
-
-    logger.info(msg=f'Inserting card text for card {card_name}')
-    warning_msg = f'Duplicate entry for card {card_name} and associated text'
-    su.execute_query(insert_query, logger, warning_msg, prod_mode)
-
-
-def insert_card_cmc(card_name, cmc, db_cursor, logger, prod_mode):
-    def insert_query():
-        insert_query = ssu.get_n_item_insert_query(2).format(
-            sql.Identifier('cards', 'cmc'),
-            sql.Identifier('card'),
-            sql.Identifier('cmc'))
-        db_cursor.execute(insert_query, (card_name, cmc))
-
-    logger.info(msg=f'Inserting cmc {cmc} for card {card_name}')
-    warning_msg = f'Duplicate entry for card {card_name} and cmc {cmc}'
-    su.execute_query(insert_query, logger, warning_msg, prod_mode)
-
-
-def insert_card_types(card_name, type_line, db_cursor, logger, prod_mode):
-    types = [card_type.lower() for card_type in type_line.split(' ') if card_type not in INVALID_TYPES]
-    for card_type in types:
-        if card_type != '—':
-            def insert_query():
-                insert_query = ssu.get_n_item_insert_query(2).format(
-                    sql.Identifier('cards', 'types'),
-                    sql.Identifier('card'),
-                    sql.Identifier('type'))
-                db_cursor.execute(insert_query, (card_name, card_type))
-
-            logger.info(msg=f'Inserting type {card_name} for card {card_name}')
-            warning_msg = f'Duplicate entry for card {card_name} with type {card_type}'
-            su.execute_query(insert_query, logger, warning_msg, prod_mode)
-
-
-def insert_card_printings(card_name: str, sets: Set[Tuple[str, str]], db_cursor, logger, prod_mode):
-    for printing, rarity in sets:
-        def insert_query():
-            insert_query = ssu.get_n_item_insert_query(3).format(
-                sql.Identifier('cards', 'printings'),
-                sql.Identifier('card'),
-                sql.Identifier('set'),
-                sql.Identifier('rarity'))
-            db_cursor.execute(insert_query, (card_name, printing, rarity))
-
-        logger.info(msg=f'Inserting printing {printing} and card {card_name}')
-        warning_msg = f'Duplicate entry for card {card_name} and printing {printing}'
-        su.execute_query(insert_query, logger, warning_msg, prod_mode)
-
-
-def get_stored_card_data(database, user, logger, prod_mode):
-    with psycopg2.connect(database=database, user=user) as conn:
-        conn.autocommit = True
-        with conn.cursor() as cursor:
+    return set([(card['set'], card['rarity']) for page in ssu.iter_pages(set_search_url) for card in page['data']])
+
+
+def get_stored_card_data(database, user, logger, batch_size=ssu.WRITER_BATCH_SIZE, commit_size=ssu.WRITER_COMMIT_SIZE):
+    """Retrieves and stores the data of every card of every set on Scryfall, paging through each set's card search.
+    :param database: name of the database
+    :param user: username to login into the database with
+    :param logger: logger to record any relevant information
+    :param batch_size: number of rows buffered before writing
+    :param commit_size: number of rows written between commits
+    :return: None
+    """
+    with closing(psycopg2.connect(database=database, user=user)) as conn:
+        with ssu.BatchWriter(conn, CARD_TABLES, logger, batch_size, commit_size) as writer:
             for set_name, set_info in si.get_set_data(logger).items():
-                cards = ssu.json_from_url(set_info['search_uri'])
-                has_cards = True
-                while has_cards:
+                for cards in ssu.iter_pages(set_info['search_uri']):  # might have multiple pages
                     for card_data in cards['data']:
-                        parse_and_store(card_data, cursor, logger, prod_mode)
-
-                    # might have multiple pages
-                    if cards['has_more']:
-                        cards = ssu.json_from_url(set_info['search_uri'])
-                    else:
-                        has_cards = False
+                        parse_and_store(card_data, writer)
+        writer.report()
 
 
-def main(prod_mode):
+def main(prod_mode, bulk_path=None, missing_only=False):
+    """Retrieves and stores the data of every card, from the Scryfall API or from a Scryfall bulk data file if given.
+    :param prod_mode: boolean signifying production or testing mode
+    :param bulk_path: path of a Scryfall bulk data file to read cards from instead of the API
+    :param missing_only: only retrieve cards played in tournaments that are missing card data
+    :return: None
+    """
     logger = su.init_logging('scryfall_card_scapper.log')
-    get_stored_card_data(dbr.DATABASE_NAME, dbr.USER, logger, prod_mode)
+    if bulk_path is not None:
+        get_bulk_card_data(bulk_path, dbr.DATABASE_NAME, dbr.USER, logger)
+        return
+
+    if missing_only:
+        get_missing_card_data(dbr.DATABASE_NAME, dbr.USER, logger)
+    else:
+        get_stored_card_data(dbr.DATABASE_NAME, dbr.USER, logger)
+    ssu.RATE_LIMITER.report(logger, 'api.scryfall.com')
 
 
 if __name__ == '__main__':
-    main(False)
+    parser = ap.ArgumentParser()
+    parser.add_argument('-b', default=None, help="path of a Scryfall bulk data file, such as 'default cards', to read "
+                                                 "cards from instead of the API")
+    parser.add_argument('-m', action='store_true',
+                        help='only retrieve cards played in tournaments that are missing card data')
+    args = parser.parse_args()
+    main(False, args.b, args.m)
@@ -18,8 +18,7 @@ def get_sets_from_db(db_cursor):
 
 def get_set_data(logger):
     logger.info('Retrieving all set info from Scryfall')
-    json_data = ssu.json_from_url(SCRYFALL_SET_URL)
-    return {printing['code']: printing for printing in json_data['data']}
+    return {printing['code']: printing for page in ssu.iter_pages(SCRYFALL_SET_URL) for printing in page['data']}
 
 
 def insert_set_data(db_cursor, code, full_name, release_date, size, logger, prod_mode):
@@ -63,6 +62,7 @@ def get_stored_set_data(database, user, logger, prod_mode):
 def main(prod_mode):
     logger = su.init_logging('scryfall_set_scrapper.log')
     get_stored_set_data(dbr.DATABASE_NAME, dbr.USER, logger, prod_mode)
+    ssu.RATE_LIMITER.report(logger, 'api.scryfall.com')
 
 
 if __name__ == '__main__':
@@ -1,24 +1,132 @@
+import concurrent.futures as cf
+import datetime as dt
+import gzip
 import json
-import time
 
-import requests
 from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+import scrapping.http_cache as hc
+import scrapping.utility as su
 
 """Module for common utility functions relating to retrieving and storing Scryfall data"""
 
 # Constants
 SCRYFALL_ENCODING = 'utf-8'
 REQUEST_DELAY = .2
+RATE_LIMITER = su.RateLimiter(1 / REQUEST_DELAY)
+SCRYFALL_TTL = dt.timedelta(days=1)
+JSON_CHUNK_SIZE = 1 << 20  # characters read from a bulk data file at a time
+JSON_SEPARATORS = ' \t\r\n,'
+WRITER_BATCH_SIZE = 5000  # rows buffered across every table before being written
+WRITER_COMMIT_SIZE = 20000  # rows written between commits
+
+
+class BatchWriter:
+    """Buffers rows for several tables, writing each table's buffered rows with a single INSERT ... ON CONFLICT DO
+    NOTHING once 'batch_size' rows are buffered across every table, and committing once 'commit_size' rows have been
+    written since the last commit. Counts the rows given and inserted for every table. Used as a context manager, any
+    remaining rows are written and committed on exit, or the open transaction is rolled back on an error."""
+
+    def __init__(self, db_conn, tables, logger, batch_size=WRITER_BATCH_SIZE, commit_size=WRITER_COMMIT_SIZE):
+        """
+        :param db_conn: connection of the database to write to, not in autocommit mode
+        :param tables: dictionary of each table to write to, as a tuple of schema and table name, to its columns
+        :param logger: logger to record any relevant information
+        :param batch_size: number of rows buffered before writing
+        :param commit_size: number of rows written between commits
+        """
+        self.db_conn = db_conn
+        self.tables = tables
+        self.logger = logger
+        self.batch_size = batch_size
+        self.commit_size = commit_size
+        self.rows = {table: [] for table in tables}
+        self.buffered = 0
+        self.uncommitted = 0
+        self.given = {table: 0 for table in tables}
+        self.inserted = {table: 0 for table in tables}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+            self.commit()
+        else:
+            self.db_conn.rollback()
+
+    def add(self, table, rows):
+        """Buffers the given rows of the given table, writing every buffered row if the batch is full.
+        :param table: table the rows belong to
+        :param rows: list of tuples of values, in the order of the table's columns
+        :return: None
+        """
+        self.rows[table].extend(rows)
+        self.buffered += len(rows)
+        if self.buffered >= self.batch_size:
+            self.flush()
+
+    def add_all(self, rows):
+        """
+        :param rows: dictionary of tables to the rows to buffer for each
+        :return: None
+        """
+        for table, table_rows in rows.items():
+            self.add(table, table_rows)
+
+    def flush(self):
+        """Writes every buffered row in the open transaction, committing if enough rows have been written since the last
+        commit.
+        :return: None
+        """
+        with self.db_conn.cursor() as cursor:
+            for table, columns in self.tables.items():
+                table_rows = self.rows[table]
+                self.inserted[table] += insert_rows(cursor, table, columns, table_rows)
+                self.given[table] += len(table_rows)
+                table_rows.clear()
+        self.uncommitted += self.buffered
+        self.buffered = 0
+        if self.uncommitted >= self.commit_size:
+            self.commit()
+
+    def commit(self):
+        self.db_conn.commit()
+        self.logger.info(f'Committed {self.uncommitted} rows')
+        self.uncommitted = 0
+
+    def report(self):
+        """Logs the number of rows given and newly inserted for every table.
+        :return: None
+        """
+        for table in self.tables:
+            self.logger.info(f'Inserted {self.inserted[table]} new rows out of {self.given[table]} into '
+                             f'{".".join(table)}')
 
 
 def json_from_url(url):
     """Given a url that sends back JSON data upon a GET request, sends a GET request for it's JSON data, loads it, then
-    returns it.
+    returns it. Goes through the HTTP cache, only waiting on the rate limiter if the request is actually sent.
     :param url: url to retrieve data from
     :return: decoded JSON data from given url
     """
-    time.sleep(REQUEST_DELAY)
-    response = requests.get(url)
+    return decode_response(hc.get(url, SCRYFALL_TTL, RATE_LIMITER))
+
+
+def json_from_post(url, payload):
+    """Given a url that sends back JSON data upon a POST request with a JSON body, such as Scryfall's card collection
+    endpoint, sends the given payload to it then loads and returns the JSON data sent back. Goes through the HTTP cache
+    like json_from_url.
+    :param url: url to send the payload to
+    :param payload: data to send as the JSON body of the request
+    :return: decoded JSON data sent back from the given url
+    """
+    return decode_response(hc.post(url, ttl=SCRYFALL_TTL, rate_limiter=RATE_LIMITER, json_data=payload))
+
+
+def decode_response(response):
     if response.ok:
         card_data = response.content.decode(SCRYFALL_ENCODING)
         return json.loads(card_data)
@@ -26,6 +134,23 @@ def json_from_url(url):
         response.raise_for_status()
 
 
+def iter_pages(url):
+    """Iterates over every page of a paginated Scryfall list, such as a card search, following each page's 'next_page'
+    url. The next page is fetched on a background thread while the current page is being processed, every fetch still
+    waiting on the shared rate limiter.
+    :param url: url of the first page of the list
+    :return: generator of the decoded JSON data of each page
+    """
+    with cf.ThreadPoolExecutor(max_workers=1) as prefetcher:
+        page = json_from_url(url)
+        while True:
+            next_page = prefetcher.submit(json_from_url, page['next_page']) if page.get('has_more') else None
+            yield page
+            if next_page is None:
+                return
+            page = next_page.result()
+
+
 def get_distinct_column_from_table(db_cursor, table, column):
     """Returns all the distinct info in the given column of the given table, in the database represented by the given
     database cursor.
@@ -55,3 +180,66 @@ def get_n_item_insert_query(n):
     return sql.SQL(query)
 
 
+def iter_json_array(path, chunk_size=JSON_CHUNK_SIZE):
+    """Lazily decodes each item of the JSON array stored in the given file, such as a Scryfall bulk data file, reading
+    the file a chunk at a time so only the current chunk and item are ever held in memory. Files ending in '.gz' are
+    decompressed as they are read.
+    :param path: path of the JSON file holding a single top level array
+    :param chunk_size: number of characters to read at a time
+    :return: generator of decoded array items
+    """
+    decoder = json.JSONDecoder()
+    opener = gzip.open if str(path).endswith('.gz') else open
+    with opener(path, 'rt', encoding=SCRYFALL_ENCODING) as json_file:
+        buffer = ''
+        at_end = False
+        while not buffer and not at_end:  # skip leading whitespace, however many chunks it runs over
+            chunk = json_file.read(chunk_size)
+            at_end = not chunk
+            buffer = chunk.lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f'{path} does not hold a JSON array')
+        position = 1
+        while True:
+            while position < len(buffer) and buffer[position] in JSON_SEPARATORS:
+                position += 1
+
+            if position < len(buffer) and buffer[position] == ']':
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+                # a number cut short by the read still decodes, as a shorter number, so an item is only complete
+                # once the separator or end of array after it has been read
+                if at_end or (end < len(buffer) and buffer[end] in JSON_SEPARATORS + ']'):
+                    position = end
+                    yield item
+                    continue
+            except json.JSONDecodeError:
+                if at_end:
+                    raise
+
+            # item runs past the end of the buffer, drop what has been decoded and read more
+            chunk = json_file.read(chunk_size)
+            at_end = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+
+
+def insert_rows(db_cursor, table, columns, rows):
+    """Inserts the given rows into the given table in a single statement, skipping any row that would violate a primary
+    key or unique constraint.
+    :param db_cursor: cursor of the database to insert rows into
+    :param table: name of the table to insert into, expected as a list of strings to account for additional schema name
+    :param columns: names of the columns being inserted into
+    :param rows: list of tuples of values, one value per column
+    :return: number of rows inserted
+    """
+    if not rows:
+        return 0
+
+    insert_query = sql.SQL('INSERT INTO {} ({}) VALUES %s ON CONFLICT DO NOTHING').format(
+        sql.Identifier(*table),
+        sql.SQL(', ').join(map(sql.Identifier, columns)))
+    execute_values(db_cursor, insert_query, rows, page_size=len(rows))  # one page so rowcount covers every row
+    return db_cursor.rowcount
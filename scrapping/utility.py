@@ -1,4 +1,6 @@
 import logging as log
+import multiprocessing as mp
+import time
 from typing import Callable
 
 import psycopg2
@@ -9,13 +11,65 @@ import psycopg2
 PSYCOPG2_UNIQUE_VIOLATION_CODE = 23505
 
 
+class RateLimiter:
+    """Token bucket limiting the rate of requests sent to a single host. Its state lives in shared memory, so one
+    limiter created before worker processes are forked limits the combined rate of every worker."""
+
+    def __init__(self, requests_per_second: float, burst: int = 1) -> None:
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.lock = mp.Lock()
+        self.tokens = mp.RawValue('d', burst)
+        self.updated = mp.RawValue('d', 0)  # time of last refill, 0 until first request
+        self.started = mp.RawValue('d', 0)
+        self.count = mp.RawValue('L', 0)
+
+    def acquire(self) -> None:
+        """Blocks until a request may be sent, then takes a token for it.
+        :return: None
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                if self.started.value == 0:
+                    self.started.value = now
+                    self.updated.value = now
+
+                elapsed = now - self.updated.value
+                self.tokens.value = min(self.burst, self.tokens.value + elapsed * self.requests_per_second)
+                self.updated.value = now
+
+                if self.tokens.value >= 1:
+                    self.tokens.value -= 1
+                    self.count.value += 1
+                    return
+                wait = (1 - self.tokens.value) / self.requests_per_second
+            time.sleep(wait)
+
+    def report(self, logger: log.Logger, host: str) -> None:
+        """Logs the number of requests sent through this limiter, and the achieved versus target request rate.
+        :param logger: logger to record the report with
+        :param host: name of the host requests were sent to
+        :return: None
+        """
+        elapsed = time.time() - self.started.value if self.started.value else 0
+        achieved = self.count.value / elapsed if elapsed else 0
+        logger.info(f'Sent {self.count.value} requests to {host} in {elapsed:.0f}s, achieved {achieved:.2f} '
+                    f'requests/s against a target of {self.requests_per_second:.2f} requests/s')
+
+
 def init_logging(log_file: str) -> log.Logger:
     """Initializes a logger set to lowest informative level (info) for printing message to console and a l file.
+    Replaces any handlers from a previous call, including ones inherited by a forked worker process, so each message is
+    printed once and only written to the latest log file.
     :param: log_file: name of log file to create
     :return: logger that can write to stream and a log file
     """
     logger = log.getLogger(__name__)
     logger.setLevel(log.INFO)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
 
     def init_channel(channel):
         formatter = log.Formatter('%(asctime)s: %(message)s')